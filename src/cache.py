@@ -0,0 +1,208 @@
+"""Columnar cache of fields extracted from h5 files.
+
+The cache holds one partition per source directory, with a row per file. Files are
+looked up by path and only served from the cache if their size and mtime match, so
+partitions do not depend on how files are chunked or filtered by a run.
+"""
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from utils import concat_columns
+
+# Columns of a partition identifying the version of each source file
+SOURCE_COLUMNS = ("size", "mtime_ns")
+
+
+def cache_key(directory: str, fields: Iterable[str]) -> str:
+    """Key of the cache partition of a source directory.
+
+    Args:
+        directory: Directory of the source files.
+        fields: Names of the cached fields.
+
+    Returns:
+        Hex digest identifying the directory and the fields.
+    """
+    digest = hashlib.sha1()
+    digest.update("\0".join(sorted(fields)).encode("utf8"))
+    digest.update(f"\n{directory}".encode("utf8"))
+
+    return digest.hexdigest()
+
+
+def partition_dir(cache_dir: Path, key: str) -> Path:
+    """Directory of a cache partition.
+
+    Args:
+        cache_dir: Root directory of the cache.
+        key: Key of the partition.
+
+    Returns:
+        Path of the partition.
+    """
+    return cache_dir / key[:2] / key
+
+
+def load_columns(cache_dir: Path, key: str) -> Dict[str, np.ndarray] | None:
+    """Load a cache partition with memory-mapped column access.
+
+    Args:
+        cache_dir: Root directory of the cache.
+        key: Key of the partition.
+
+    Returns:
+        Mapping of column name to memory-mapped array, None if the partition is missing.
+    """
+    part_dir = partition_dir(cache_dir, key)
+
+    if not part_dir.is_dir():
+        return None
+
+    try:
+        return {
+            file_path.stem: np.load(file_path, mmap_mode="r")
+            for file_path in part_dir.glob("*.npy")
+        }
+    except OSError:
+        # Replaced concurrently by another process
+        return None
+
+
+def save_columns(cache_dir: Path, key: str, columns: Dict[str, np.ndarray]) -> None:
+    """Write a cache partition with one .npy file per column.
+
+    The partition is written to a temporary directory and renamed, so readers never
+    see partial partitions. A previous version of the partition is replaced.
+
+    Args:
+        cache_dir: Root directory of the cache.
+        key: Key of the partition.
+        columns: Mapping of column name to array.
+    """
+    part_dir = partition_dir(cache_dir, key)
+    tmp_dir = part_dir.with_name(f"{key}.tmp-{os.getpid()}")
+    old_dir = part_dir.with_name(f"{key}.old-{os.getpid()}")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    for name, values in columns.items():
+        np.save(tmp_dir / f"{name}.npy", np.asarray(values))
+
+    try:
+        if part_dir.exists():
+            part_dir.rename(old_dir)
+        tmp_dir.rename(part_dir)
+    except OSError:
+        # Written concurrently by another process
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def group_by_directory(paths: Iterable[str]) -> Dict[str, List[str]]:
+    """Group paths by their directory.
+
+    Args:
+        paths: File paths.
+
+    Returns:
+        Paths per directory, in their original order.
+    """
+    groups = {}
+
+    for path in paths:
+        groups.setdefault(os.path.dirname(path), []).append(path)
+
+    return groups
+
+
+def load_files(
+    cache_dir: Path, files: Dict[str, os.stat_result], fields: Iterable[str]
+) -> Tuple[Dict[str, np.ndarray] | None, List[str]]:
+    """Cached columns of files that did not change since they were cached.
+
+    Args:
+        cache_dir: Root directory of the cache.
+        files: Stat result of each source file by path.
+        fields: Names of the cached fields.
+
+    Returns:
+        Columns of the fields plus a path column for the cached files (None if no file
+        is cached), and paths of the other files.
+    """
+    parts, missing = [], []
+
+    for directory, paths in group_by_directory(files).items():
+        columns = load_columns(cache_dir, cache_key(directory, fields))
+
+        if columns is None:
+            missing.extend(paths)
+            continue
+
+        rows = {path: i for i, path in enumerate(columns["path"].tolist())}
+        hits = []
+
+        for path in paths:
+            i, stat = rows.get(path), files[path]
+            if (
+                i is not None
+                and columns["size"][i] == stat.st_size
+                and columns["mtime_ns"][i] == stat.st_mtime_ns
+            ):
+                hits.append(i)
+            else:
+                missing.append(path)
+
+        if hits:
+            parts.append(
+                {
+                    name: col[hits]
+                    for name, col in columns.items()
+                    if name not in SOURCE_COLUMNS
+                }
+            )
+
+    return (concat_columns(parts) if parts else None), missing
+
+
+def save_files(
+    cache_dir: Path,
+    columns: Dict[str, np.ndarray],
+    files: Dict[str, os.stat_result],
+    fields: Iterable[str],
+) -> None:
+    """Add files to the partitions of their directories.
+
+    Earlier rows of the same files are replaced, rows of other files are kept. If
+    processes update a partition concurrently, the last one wins and the files of
+    the others are read again by a later run.
+
+    Args:
+        cache_dir: Root directory of the cache.
+        columns: Columns of the fields plus a path column, one row per file.
+        files: Stat result of each source file by path.
+        fields: Names of the cached fields.
+    """
+    index = {path: i for i, path in enumerate(columns["path"].tolist())}
+
+    for directory, paths in group_by_directory(index).items():
+        rows = [index[path] for path in paths]
+
+        new = {name: col[rows] for name, col in columns.items()}
+        new["size"] = np.array([files[path].st_size for path in paths], dtype=np.int64)
+        new["mtime_ns"] = np.array(
+            [files[path].st_mtime_ns for path in paths], dtype=np.int64
+        )
+
+        key = cache_key(directory, fields)
+        old = load_columns(cache_dir, key)
+
+        if old is not None and set(old) == set(new):
+            keep = ~np.isin(old["path"], new["path"])
+            new = concat_columns([{name: col[keep] for name, col in old.items()}, new])
+
+        save_columns(cache_dir, key, new)
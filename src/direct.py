@@ -0,0 +1,194 @@
+"""Direct load of the final tables, deduplicating dimensions in memory."""
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.future import Connection
+
+# Tables whose ids are assigned by the client, since other rows reference them
+CLIENT_IDS = ("artists", "locations", "albums")
+
+# Columns of the songs table taken from the intermediary song rows
+SONG_COLUMNS = (
+    "track_id",
+    "title",
+    "year",
+    "danceability",
+    "duration",
+    "end_of_fade_in",
+    "start_of_fade_out",
+    "loudness",
+    "bpm",
+)
+
+
+class DirectLoad:
+    """Hash maps of the dimension tables of a direct load.
+
+    Batches of intermediary rows (as read for the artists_init and songs_init tables)
+    are turned into rows of the final tables with the same rules as the SQL stages.
+    Surrogate ids are assigned client-side, after the largest id of each table.
+    """
+
+    def __init__(self) -> None:
+        """Initialize empty maps."""
+        self.artists: Dict[str, int] = {}
+        self.locations: Dict[str, int] = {}
+        self.albums: Dict[Tuple[str, int | None], int] = {}
+        self.artist_locations: Set[Tuple[int, int]] = set()
+        self.next_ids = {tbl: 1 for tbl in CLIENT_IDS}
+
+        # Songs without a track id, which are not loaded like in `run_song_pipeline`
+        self.n_skipped = 0
+
+        # Distinct locations (None if missing) of each artist and distinct
+        # coordinates of each location, in the rows of this load
+        self._artist_location_names: Dict[str, Set[str | None]] = {}
+        self._location_coords: Dict[str, Tuple[set, set]] = {}
+
+    def load_existing(self, conn: Connection) -> None:
+        """Read the dimensions that are already in the database.
+
+        Args:
+            conn: Connection holding locks on the final tables.
+        """
+        self.artists = dict(conn.execute(text("SELECT name, id FROM artists")).all())
+        self.locations = dict(
+            conn.execute(text("SELECT name, id FROM locations")).all()
+        )
+        self.albums = {
+            (title, artist_id): album_id
+            for album_id, title, artist_id in conn.execute(
+                text("SELECT id, title, artist_id FROM albums")
+            )
+        }
+        self.artist_locations = set(
+            conn.execute(
+                text("SELECT artist_id, location_id FROM artists_locations")
+            ).all()
+        )
+
+        for tbl in CLIENT_IDS:
+            max_id = conn.execute(text(f"SELECT MAX(id) FROM {tbl}")).scalar()
+            self.next_ids[tbl] = (max_id or 0) + 1
+
+    def _new_id(self, tbl: str) -> int:
+        """Assign the next id of a table.
+
+        Args:
+            tbl: Name of the table.
+
+        Returns:
+            Unused id.
+        """
+        new_id = self.next_ids[tbl]
+        self.next_ids[tbl] += 1
+        return new_id
+
+    def add_batch(
+        self, artist_rows: List[dict], song_rows: List[dict]
+    ) -> Dict[str, List[dict]]:
+        """Deduplicate a batch of intermediary rows.
+
+        Artist and song rows are aligned, one of each per song. Artists and albums of
+        songs without a track id are kept, the songs are skipped.
+
+        Args:
+            artist_rows: Rows for the intermediary artists table.
+            song_rows: Rows for the intermediary songs table.
+
+        Returns:
+            New rows of the artists and albums tables and rows of the songs table.
+        """
+        new_rows = {"artists": [], "albums": [], "songs": []}
+
+        for artist, song in zip(artist_rows, song_rows):
+            name, location = artist["name"], artist["location"]
+
+            if location is not None:
+                lats, lngs = self._location_coords.setdefault(location, (set(), set()))
+                lats.add(artist["latitude"])
+                lngs.add(artist["longitude"])
+
+            artist_id = None
+
+            if name is not None:
+                self._artist_location_names.setdefault(name, set()).add(location)
+
+                artist_id = self.artists.get(name)
+                if artist_id is None:
+                    artist_id = self.artists[name] = self._new_id("artists")
+                    new_rows["artists"].append({"id": artist_id, "name": name})
+
+            album_name, album_id = song["album_name"], None
+
+            if album_name is not None:
+                album_id = self.albums.get((album_name, artist_id))
+                if album_id is None:
+                    album_id = self._new_id("albums")
+                    self.albums[(album_name, artist_id)] = album_id
+                    new_rows["albums"].append(
+                        {"id": album_id, "title": album_name, "artist_id": artist_id}
+                    )
+
+            if song["track_id"] is None:
+                self.n_skipped += 1
+                continue
+
+            song_row = {col: song[col] for col in SONG_COLUMNS}
+            # Songs without an artist are not linked to an album
+            song_row["album_id"] = album_id if artist_id is not None else None
+            song_row["artist_id"] = artist_id
+            new_rows["songs"].append(song_row)
+
+        return new_rows
+
+    def finish(self) -> Dict[str, List[dict]]:
+        """Locations and artist-location mapping of all rows added.
+
+        Coordinates are only kept if they are unique and never missing for a
+        location. An artist is mapped to a location if all of its rows share the same,
+        non-missing location.
+
+        Returns:
+            New rows of the locations and artists_locations tables.
+        """
+        new_rows = {"locations": [], "artists_locations": []}
+
+        for location, (lats, lngs) in self._location_coords.items():
+            if location in self.locations:
+                continue
+            location_id = self.locations[location] = self._new_id("locations")
+            new_rows["locations"].append(
+                {
+                    "id": location_id,
+                    "name": location,
+                    "latitude": unique_value(lats),
+                    "longitude": unique_value(lngs),
+                }
+            )
+
+        for name, locations in self._artist_location_names.items():
+            if len(locations) != 1 or None in locations:
+                continue
+            pair = (self.artists[name], self.locations[next(iter(locations))])
+            if pair not in self.artist_locations:
+                self.artist_locations.add(pair)
+                new_rows["artists_locations"].append(
+                    {"artist_id": pair[0], "location_id": pair[1]}
+                )
+
+        return new_rows
+
+
+def unique_value(values: set) -> float | None:
+    """Value of a set with exactly one, non-missing value.
+
+    Args:
+        values: Distinct values, None for missing values.
+
+    Returns:
+        The value, None if there are several or missing values.
+    """
+    if len(values) != 1:
+        return None
+    return next(iter(values))
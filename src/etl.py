@@ -1,252 +1,1764 @@
 """ETL pipeline."""
 import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import closing, contextmanager, nullcontext
+from functools import partial, wraps
+from itertools import islice
 from pathlib import Path
-
-from sqlalchemy import Column, select, text
-from sqlalchemy.engine import Result
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from sqlalchemy import (
+    ForeignKeyConstraint,
+    Table,
+    UniqueConstraint,
+    bindparam,
+    event,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Row
+from sqlalchemy.future import Connection
 from sqlalchemy.future.engine import Engine
+from sqlalchemy.schema import AddConstraint, CreateIndex, DropConstraint, DropIndex
+from sqlalchemy.sql import Executable
+from sqlalchemy.sql.elements import TextClause
+
+from cache import load_files, save_files
+from direct import CLIENT_IDS, DirectLoad
+from loader import COPY_FORMATS, copy_rows
+from read import SONG_FIELDS, get_file_paths, read_analysis, read_h5, read_summary
+from report import RunReport, StageStats
+from scheduler import Graph, critical_path, run_graph
+from session import PROFILES, apply_settings, reset_settings, set_setting
+from tables import init_indexes
+from utils import (
+    SharedIterator,
+    cast_numeric_array,
+    chunked,
+    concat_columns,
+    encode_str,
+    encode_str_array,
+    prefetch,
+)
+
+LOADERS = ("insert", "copy")
+
+# How the intermediary tables are stored: unlogged tables skip the write-ahead log,
+# temp tables live in the session of a connection shared by all stages, logged tables
+# are regular tables, e.g. for debugging
+STAGING_MODES = ("unlogged", "temp", "logged")
+
+# Stages of a run and the stages they depend on
+STAGES: Graph = {
+    "run_initial_pipeline": (),
+    "run_analysis_pipeline": (),
+    "create_init_indexes": ("run_initial_pipeline",),
+    "run_artist_pipeline": ("create_init_indexes",),
+    "run_location_pipeline": ("create_init_indexes",),
+    "run_artist_location_pipeline": ("run_artist_pipeline", "run_location_pipeline"),
+    "run_album_pipeline": ("run_artist_pipeline",),
+    "run_song_pipeline": ("run_album_pipeline",),
+    "run_file_pipeline": ("run_song_pipeline", "run_analysis_pipeline"),
+    "drop_init_tables": ("run_artist_location_pipeline", "run_file_pipeline"),
+}
+
+# Stages of a direct load, which reads files once more for the analysis arrays and
+# must not record them in the manifest before
+DIRECT_STAGES: Graph = {
+    "run_analysis_pipeline": (),
+    "run_direct_pipeline": ("run_analysis_pipeline",),
+}
+
+# Additional stages and dependencies of a bulk load, which defers the constraints and
+# indexes of the final tables until they are loaded
+BULK_STAGES: Graph = {
+    "defer_final_constraints": (),
+    "create_init_indexes": ("defer_final_constraints",),
+    "restore_final_constraints": ("run_artist_location_pipeline", "run_song_pipeline"),
+    "run_file_pipeline": ("restore_final_constraints",),
+}
+
+# Final tables whose constraints and indexes are deferred in a bulk load
+DEFERRED_TABLES = ("artists", "locations", "artists_locations", "albums", "songs")
+
+# Actual rows of the top node of an EXPLAIN ANALYZE plan, and inserted rows of an
+# INSERT ... ON CONFLICT
+PLAN_ROWS = re.compile(r"\(actual time=\S+ rows=([\d.]+) loops=\d+\)")
+PLAN_INSERTED = re.compile(r"^\s*Tuples Inserted: ([\d.]+)", re.MULTILINE)
+
+# Rows per intermediary table and failed files of a chunk of files
+Batch = Tuple[Dict[str, List[dict]], List[Tuple[Path, str]]]
+
+
+def artist_columns(songs: Dict[str, np.ndarray]) -> Dict[str, list]:
+    """Column buffers for the intermediary artists table.
+
+    Args:
+        songs: Columns of song fields.
+
+    Returns:
+        Column values of the rows.
+    """
+    return {
+        "name": encode_str_array(songs["artist_name"]),
+        "location": encode_str_array(songs["artist_location"]),
+        "latitude": cast_numeric_array(songs["artist_latitude"]),
+        "longitude": cast_numeric_array(songs["artist_longitude"]),
+    }
+
+
+def song_columns(songs: Dict[str, np.ndarray]) -> Dict[str, list]:
+    """Column buffers for the intermediary songs table.
+
+    Args:
+        songs: Columns of song fields.
+
+    Returns:
+        Column values of the rows.
+    """
+    return {
+        "title": encode_str_array(songs["title"]),
+        "year": cast_numeric_array(songs["year"]),
+        "danceability": cast_numeric_array(songs["danceability"]),
+        "duration": cast_numeric_array(songs["duration"]),
+        "end_of_fade_in": cast_numeric_array(songs["end_of_fade_in"]),
+        "start_of_fade_out": cast_numeric_array(songs["start_of_fade_out"]),
+        "loudness": cast_numeric_array(songs["loudness"]),
+        "bpm": cast_numeric_array(songs["tempo"]),
+        "album_name": encode_str_array(songs["release"]),
+        "artist_name": encode_str_array(songs["artist_name"]),
+        "track_id": encode_str_array(songs["track_id"]),
+    }
+
+
+def to_rows(columns: Dict[str, list]) -> List[dict]:
+    """Convert column buffers to rows.
+
+    Args:
+        columns: Column values keyed by column name.
+
+    Returns:
+        Rows keyed by column name.
+    """
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def read_songs(
+    file_paths: Iterable[Path],
+) -> Tuple[Dict[str, np.ndarray], List[Tuple[Path, str]]]:
+    """Read h5 files into columns of song fields.
+
+    Args:
+        file_paths: Paths of h5 files.
+
+    Returns:
+        Columns of song fields plus a path column, and (path, error message) of files
+        that failed.
+    """
+    records, paths, failures = [], [], []
+
+    for file_path in file_paths:
+        try:
+            records.append(read_h5(file_path))
+            paths.append(str(file_path))
+        except (OSError, KeyError, ValueError) as err:
+            failures.append((file_path, str(err)))
+
+    if not records:
+        return {}, failures
+
+    songs = {field: np.array([rec[field] for rec in records]) for field in records[0]}
+    songs["path"] = np.array(paths)
+
+    return songs, failures
+
+
+def extract_rows(file_paths: List[Path], cache_dir: Path | None = None) -> Batch:
+    """Read h5 files and convert them to rows for the intermediary tables.
+
+    Fields are collected into columns across all files of the chunk and transformed
+    in one vectorized pass. With a `cache_dir`, fields of files that did not change
+    are served from the columnar cache, and the other files are added to it. Runs in
+    worker processes in parallel mode, so only plain rows are returned.
+
+    Args:
+        file_paths: Paths of h5 files.
+        cache_dir: Root directory of the columnar cache.
+
+    Returns:
+        Rows per intermediary table and (path, error message) of files that failed.
+    """
+    stats, failures = {}, []
+
+    for file_path in file_paths:
+        try:
+            stats[str(file_path)] = file_path.stat()
+        except OSError as err:
+            failures.append((file_path, str(err)))
+
+    fields = [field for names in SONG_FIELDS.values() for field in names]
+    cached, to_read = None, list(stats)
+
+    if cache_dir is not None:
+        cached, to_read = load_files(cache_dir, stats, fields)
+
+    songs, read_failures = read_songs(Path(path) for path in to_read)
+    failures.extend(read_failures)
+
+    if cache_dir is not None and songs:
+        save_files(cache_dir, songs, stats, fields)
+
+    parts = [part for part in (cached, songs) if part]
+
+    if not parts:
+        return {"artists_init": [], "songs_init": [], "files_init": []}, failures
+
+    # Rows in the order of the chunk
+    songs = concat_columns(parts)
+    position = {path: i for i, path in enumerate(stats)}
+    order = np.argsort([position[path] for path in songs["path"].tolist()])
+    songs = {field: col[order] for field, col in songs.items()}
+
+    try:
+        rows = chunk_rows(songs, stats)
+    except UnicodeDecodeError:
+        # Strings are decoded for the whole chunk, only drop the files that failed
+        songs, invalid = drop_undecodable(songs)
+        failures.extend(invalid)
+        rows = chunk_rows(songs, stats)
+
+    return rows, failures
+
+
+def chunk_rows(
+    songs: Dict[str, np.ndarray], stats: Dict[str, os.stat_result]
+) -> Dict[str, List[dict]]:
+    """Convert columns of song fields to rows for the intermediary tables.
+
+    Args:
+        songs: Columns of song fields plus a path column.
+        stats: Stat result of each file by path.
+
+    Returns:
+        Rows per intermediary table.
+    """
+    paths = songs["path"].tolist()
+
+    return {
+        "artists_init": to_rows(artist_columns(songs)),
+        "songs_init": to_rows(song_columns(songs)),
+        "files_init": to_rows(
+            {
+                "path": paths,
+                "size": [stats[path].st_size for path in paths],
+                "mtime": [stats[path].st_mtime for path in paths],
+                "track_id": encode_str_array(songs["track_id"]),
+            }
+        ),
+    }
+
+
+def drop_undecodable(
+    songs: Dict[str, np.ndarray],
+) -> Tuple[Dict[str, np.ndarray], List[Tuple[Path, str]]]:
+    """Drop the files with byte strings that are not valid UTF-8.
+
+    Args:
+        songs: Columns of song fields plus a path column.
+
+    Returns:
+        Columns of the other files, and (path, error message) of the dropped files.
+    """
+    errors = {}
+
+    for col in songs.values():
+        if col.dtype.kind != "S":
+            continue
+        for i, val in enumerate(col.tolist()):
+            try:
+                val.decode("utf8")
+            except UnicodeDecodeError as err:
+                errors.setdefault(i, str(err))
+
+    valid = np.ones(len(songs["path"]), dtype=bool)
+    valid[list(errors)] = False
+
+    failures = [(Path(songs["path"][i]), error) for i, error in errors.items()]
+
+    return {field: col[valid] for field, col in songs.items()}, failures
+
+
+def extract_analysis(
+    file_paths: List[Path],
+) -> Tuple[List[dict], List[Tuple[Path, str]]]:
+    """Read the analysis arrays of h5 files as rows for the track analysis table.
+
+    Of several tracks with the same track id in the chunk, the last one is kept, like
+    in `run_song_pipeline`. Files with a track without a track id are not loaded.
+
+    Args:
+        file_paths: Paths of h5 files.
+
+    Returns:
+        Rows and (path, error message) of files that failed.
+    """
+    tracks, failures = {}, []
+
+    for file_path in file_paths:
+        try:
+            file_tracks = read_analysis(file_path)
+            for track in file_tracks:
+                track["track_id"] = encode_str(track["track_id"])
+        except (OSError, KeyError, ValueError) as err:
+            failures.append((file_path, str(err)))
+            continue
+
+        if any(track["track_id"] is None for track in file_tracks):
+            failures.append((file_path, "Missing track id"))
+            continue
+
+        for track in file_tracks:
+            tracks[track["track_id"]] = track
+
+    return list(tracks.values()), failures
+
+
+def plan_counts(plan: str) -> Tuple[int, int]:
+    """Rows written and inserted by an INSERT ... RETURNING, from its analyzed plan.
+
+    Args:
+        plan: Text of the EXPLAIN ANALYZE plan.
+
+    Returns:
+        Number of rows returned by the insert, and of rows inserted rather than
+        updated; all rows are inserted without a conflict clause.
+    """
+    n_written = round(float(PLAN_ROWS.search(plan).group(1)))
+
+    inserted = PLAN_INSERTED.search(plan)
+    if inserted is None:
+        return n_written, n_written
+
+    return n_written, round(float(inserted.group(1)))
+
+
+def deferrable_constraints(table: Table) -> Tuple[list, List[ForeignKeyConstraint]]:
+    """Constraints and indexes of a table that can be built after a bulk load.
+
+    Args:
+        table: Table of the metadata.
+
+    Returns:
+        Indexes and unique constraints, and foreign key constraints.
+    """
+    indexes = sorted(table.indexes, key=lambda index: index.name)
+    indexes += [
+        constraint
+        for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint)
+    ]
+    foreign_keys = [
+        constraint
+        for constraint in table.constraints
+        if isinstance(constraint, ForeignKeyConstraint)
+    ]
+
+    return indexes, foreign_keys
+
+
+def timed_call(func: Callable, *args: Any) -> Tuple[Any, float]:
+    """Call a function and measure the CPU time of the calling thread.
+
+    Wraps tasks of worker processes and threads, whose CPU time the stage adds up.
+
+    Args:
+        func: Function to call.
+        args: Arguments of the function.
+
+    Returns:
+        Result of the call and CPU time in seconds.
+    """
+    start = time.thread_time()
+    res = func(*args)
+    return res, time.thread_time() - start
+
+
+def thread_cpu(iterable: Iterable, stats: StageStats) -> Iterator:
+    """Iterate, adding the CPU time of the iterating thread to the stats of a stage.
+
+    Wraps iterables consumed by the background thread of `prefetch`.
+
+    Args:
+        iterable: Items to produce.
+        stats: Stats of the stage the thread works for.
+
+    Yields:
+        Items of the iterable.
+    """
+    start = time.thread_time()
+    try:
+        yield from iterable
+    finally:
+        stats.cpu_time += time.thread_time() - start
+
+
+def count_statement(conn: Connection, *args: Any) -> None:
+    """Count a statement towards the stage running on the connection.
+
+    Listener for the before_cursor_execute event of the engine.
+
+    Args:
+        conn: Connection executing the statement.
+        args: Remaining event arguments.
+    """
+    stats = conn.info.get("stage_stats")
+    if stats is not None:
+        stats.statements += 1
+
+
+def stage(method: Callable) -> Callable:
+    """Run a pipeline stage on a single connection and transaction.
+
+    Wall time, CPU time, rows and statements of the stage are added to the run report.
+    The statement timeout of the stage, if any, applies to its connection (and to
+    the connections of its workers, see `_set_timeout`).
+
+    Args:
+        method: Stage method of the pipeline.
+
+    Returns:
+        Wrapped method.
+    """
 
-from read import get_file_paths, read_h5
-from utils import cast_numeric, encode_str
+    @wraps(method)
+    def wrapper(self: "Pipeline", *args: Any, **kwargs: Any) -> Any:
+        stats = StageStats(method.__name__)
+        stats.start()
+
+        with self._connection() as conn:
+            previous = self._set_timeout(conn, method.__name__)
+
+            conn.info["stage_stats"] = stats
+            try:
+                res = method(self, *args, **kwargs)
+                self._save_checkpoint(method.__name__)
+            finally:
+                del conn.info["stage_stats"]
+
+            if previous is not None:
+                set_setting(conn, "statement_timeout", previous)
+
+        stats.stop()
+        self.report.stages.append(stats)
+
+        logging.info(
+            "Stage %s took %.2fs (%d rows out).",
+            stats.name,
+            stats.wall_time,
+            stats.rows_out,
+        )
+
+        return res
+
+    return wrapper
 
 
 class Pipeline:
     """ETL process."""
 
-    def __init__(self, engine: Engine, tables: dict) -> None:
+    def __init__(
+        self,
+        engine: Engine,
+        tables: dict,
+        batch_size: int = 1000,
+        loader: str = "insert",
+        copy_format: str = "text",
+        parallel: bool = False,
+        workers: int | None = None,
+        explain_dir: Path | None = None,
+        incremental: bool = False,
+        queue_size: int = 4,
+        summary_file: Path | None = None,
+        cache_dir: Path | None = None,
+        analysis: bool = False,
+        analysis_batch_size: int = 100,
+        report_path: Path | None = None,
+        data_dir: Path = Path("data"),
+        concurrent_stages: int = 4,
+        resume: bool = False,
+        staging: str = "unlogged",
+        direct: bool = False,
+        bulk: bool = False,
+        profile: str = "default",
+        statement_timeouts: Dict[str, str] | None = None,
+        shards: int = 1,
+    ) -> None:
         """Initialize pipline.
 
         Args:
             engine: Engine to connect to.
             tables: Dictionary with table objects.
+            batch_size: Number of files loaded per transaction in the initial pipeline.
+            loader: How batches are loaded into the intermediary tables, insert or copy.
+            copy_format: Format used by the copy loader, text or binary.
+            parallel: Whether to read files in a pool of worker processes.
+            workers: Number of worker processes, defaults to the number of CPUs.
+            explain_dir: Directory to write EXPLAIN ANALYZE plans of the SQL stages to.
+            incremental: Whether to skip files that were already ingested unchanged.
+            queue_size: Number of batches buffered between reading and loading.
+            summary_file: Aggregate summary file (msd_summary_file.h5) to read all songs
+                from, instead of one h5 file per song in `data_dir`.
+            cache_dir: Directory of a columnar cache of the fields read from h5 files,
+                so reruns do not decode unchanged files again.
+            analysis: Whether to load the analysis arrays (segments, beats, ...) of each
+                track into the track analysis table.
+            analysis_batch_size: Number of files loaded per COPY of analysis arrays.
+            report_path: File to write the JSON run report to.
+            data_dir: Directory searched recursively for h5 files.
+            concurrent_stages: Maximum number of independent stages run at the same
+                time, each on its own connection; 1 runs the stages in sequence.
+            resume: Whether to continue an interrupted run, skipping completed stages
+                and files that were already loaded into the intermediary tables.
+            staging: How the intermediary tables are stored, unlogged, temp or logged.
+                Temp tables are only visible to their connection, so stages run in
+                sequence on one shared connection.
+            direct: Whether to load the final tables directly, deduplicating artists,
+                locations and albums in memory instead of in intermediary tables.
+                Files in the manifest are always skipped.
+            bulk: Whether to load empty final tables without their constraints and
+                secondary indexes, which are built once the tables are loaded.
+            profile: Session settings applied to all connections of a run (see
+                `session.PROFILES`), e.g. bulk for large loads.
+            statement_timeouts: Statement timeout per stage name, e.g.
+                {"run_song_pipeline": "2h"}.
+            shards: Number of connections loading batches of files concurrently in the
+                initial pipeline, each taking the next batch from a shared queue.
         """
+        if loader not in LOADERS:
+            raise ValueError(f"Unknown loader: {loader}")
+        if copy_format not in COPY_FORMATS:
+            raise ValueError(f"Unknown COPY format: {copy_format}")
+        if staging not in STAGING_MODES:
+            raise ValueError(f"Unknown staging mode: {staging}")
+        if staging == "temp" and resume:
+            raise ValueError("Temp staging tables do not outlive a run to resume")
+        if bulk and direct:
+            raise ValueError("Bulk loads are only supported with intermediary tables")
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown session profile: {profile}")
+        if shards < 1:
+            raise ValueError(f"Number of shards must be at least 1, got {shards}")
+        if workers is not None and workers < 1:
+            raise ValueError(f"Number of workers must be at least 1, got {workers}")
+        if shards > 1 and staging == "temp":
+            raise ValueError("Temp staging tables are only visible to one connection")
+        if shards > 1 and summary_file is not None:
+            raise ValueError("Slices of the summary file are loaded in order")
+
         self.engine = engine
         self.tables = tables
+        self.batch_size = batch_size
+        self.loader = loader
+        self.copy_format = copy_format
+        self.parallel = parallel
+        self.workers = workers or os.cpu_count()
+        self.explain_dir = explain_dir
+        self.incremental = incremental
+        self.queue_size = queue_size
+        self.summary_file = summary_file
+        self.cache_dir = cache_dir
+        self.analysis = analysis
+        self.analysis_batch_size = analysis_batch_size
+        self.report_path = report_path
+        self.data_dir = data_dir
+        self.concurrent_stages = concurrent_stages
+        self.resume = resume
+        self.staging = staging
+        self.direct = direct
+        self.bulk = bulk
+        self.profile = profile
+        self.statement_timeouts = statement_timeouts or {}
+        self.shards = shards
+
+        unknown = set(self.statement_timeouts) - set(self._stage_graph())
+        if unknown:
+            raise ValueError(
+                f"Statement timeouts of stages that do not run: {sorted(unknown)}, "
+                f"stages are {sorted(self._stage_graph())}"
+            )
+
+        self._checkpoints: Dict[str, Tuple[int, bool]] = {}
+        self.report = RunReport()
+        self._local = threading.local()
+        self._shared_conn: Connection | None = None
+        self._deferred = False
+
+        if not event.contains(engine, "before_cursor_execute", count_statement):
+            event.listen(engine, "before_cursor_execute", count_statement)
+
+    def _apply_profile(self, dbapi_conn: Any, *args: Any) -> None:
+        """Apply the session profile to a connection.
+
+        Listener for the checkout event of the engine during a run.
+
+        Args:
+            dbapi_conn: Connection checked out from the pool.
+            args: Remaining event arguments.
+        """
+        apply_settings(dbapi_conn, PROFILES[self.profile])
+
+    @staticmethod
+    def _reset_profile(dbapi_conn: Any, *args: Any) -> None:
+        """Reset session settings before a connection returns to the pool.
+
+        Listener for the checkin event of the engine during a run.
+
+        Args:
+            dbapi_conn: Connection checked in to the pool, None if it was invalidated.
+            args: Remaining event arguments.
+        """
+        if dbapi_conn is not None:
+            reset_settings(dbapi_conn)
+
+    def _set_timeout(self, conn: Connection, stage: str) -> str | None:
+        """Apply the statement timeout of a stage to a connection.
+
+        Connections opened by the workers of a stage are returned to the pool at the
+        end of the stage, which resets their settings.
+
+        Args:
+            conn: Connection of the stage or of one of its workers.
+            stage: Name of the stage.
+
+        Returns:
+            Previous timeout, None if the stage has no timeout.
+        """
+        timeout = self.statement_timeouts.get(stage)
+
+        if timeout is None:
+            return None
+
+        return set_setting(conn, "statement_timeout", timeout)
+
+    @property
+    def _conn(self) -> Connection | None:
+        """Connection of the stage running in the current thread."""
+        return getattr(self._local, "conn", None)
 
-    def _execute(self, stmt: str | text) -> Result:
+    @_conn.setter
+    def _conn(self, conn: Connection | None) -> None:
+        self._local.conn = conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[Connection]:
+        """Hold a single connection for the duration of a stage.
+
+        Statements run with `_execute` and `_commit` share this connection and its
+        transaction, which is committed at the end and rolled back on errors. Nested
+        calls reuse the open connection. Connections are held per thread, so
+        concurrent stages do not share them, unless a connection is shared by the whole
+        run for temp staging tables.
+
+        Yields:
+            Connection of the current stage.
+        """
+        if self._conn is not None:
+            yield self._conn
+            return
+
+        if self._shared_conn is not None:
+            connection = nullcontext(self._shared_conn)
+        else:
+            connection = self.engine.connect()
+
+        with connection as conn:
+            self._conn = conn
+            try:
+                yield conn
+                conn.commit()
+            finally:
+                self._conn = None
+
+    def _stage_stats(self) -> StageStats:
+        """Measurements of the stage running on the current connection.
+
+        Returns:
+            Stats of the current stage.
+        """
+        return self._conn.info["stage_stats"]
+
+    def _execute(self, stmt: Executable) -> List[Row]:
         """Run a query.
 
         Args:
             stmt: Query to run.
 
         Returns:
-            Result of the query.
+            Rows of the query, fully buffered.
         """
-        with self.engine.connect() as conn:
-            res = conn.execute(stmt)
-        return res
+        with self._connection() as conn:
+            return conn.execute(stmt).all()
+
+    def _commit(self, stmt: Executable) -> None:
+        """Run a query in the transaction of the current stage.
 
-    def _commit(self, stmt: str | text) -> None:
-        """Run a query and commit it.
+        Outside of a stage, the query is committed immediately.
 
         Args:
             stmt: Query to run.
         """
-        with self.engine.connect() as conn:
+        with self._connection() as conn:
             conn.execute(stmt)
+
+    def _map_chunks(
+        self,
+        func: Callable,
+        file_paths: Iterable[Path],
+        chunk_size: int,
+        stats: StageStats,
+    ) -> Iterator[Any]:
+        """Apply a function to chunks of files.
+
+        In parallel mode chunks are processed by a pool of worker processes and results
+        are yielded in order of completion. At most two chunks per worker are in
+        flight, so paths are consumed lazily, and closing the generator only waits for
+        the running chunks. CPU time of the workers is added to the stats of the stage.
+
+        Args:
+            func: Picklable function of a list of paths.
+            file_paths: Paths of h5 files.
+            chunk_size: Number of files per chunk.
+            stats: Stats of the stage the chunks are processed for.
+
+        Yields:
+            Result for each chunk of files.
+        """
+        chunks = chunked(file_paths, chunk_size)
+
+        if not self.parallel:
+            yield from map(func, chunks)
+            return
+
+        def result(future: Future) -> Any:
+            res, cpu_time = future.result()
+            stats.cpu_time += cpu_time
+            return res
+
+        executor = ProcessPoolExecutor(max_workers=self.workers)
+        pending = set()
+
+        try:
+            for chunk in chunks:
+                pending.add(executor.submit(timed_call, func, chunk))
+
+                if len(pending) >= 2 * self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield result(future)
+
+            for future in as_completed(pending):
+                yield result(future)
+        finally:
+            # Chunks not started yet are dropped if the consumer stops early
+            executor.shutdown(cancel_futures=True)
+
+    def _prefetch(self, iterable: Iterable) -> Iterator:
+        """Iterate in a background thread, buffering at most `queue_size` items.
+
+        CPU time of the background thread is added to the stats of the current stage.
+        Callers close the iterator when done, so the thread stops if loading fails.
+
+        Args:
+            iterable: Items to produce.
+
+        Returns:
+            Items of the iterable.
+        """
+        return prefetch(thread_cpu(iterable, self._stage_stats()), self.queue_size)
+
+    def _extract_batches(self, file_paths: Iterable[Path]) -> Iterator[Batch]:
+        """Read files in chunks of `batch_size`.
+
+        Args:
+            file_paths: Paths of h5 files.
+
+        Returns:
+            Rows and failures for each chunk of files.
+        """
+        extract = partial(extract_rows, cache_dir=self.cache_dir)
+        return self._map_chunks(
+            extract, file_paths, self.batch_size, self._stage_stats()
+        )
+
+    def _summary_batches(self, file_paths: Iterable[Path]) -> Iterator[Batch]:
+        """Read aggregate summary files in row slices of `batch_size`.
+
+        Args:
+            file_paths: Paths of summary files.
+
+        Yields:
+            Rows for each slice; the file itself is recorded after its last slice.
+        """
+        for file_path in file_paths:
+            for songs in read_summary(file_path, chunk_size=self.batch_size):
+                rows = {
+                    "artists_init": to_rows(artist_columns(songs)),
+                    "songs_init": to_rows(song_columns(songs)),
+                }
+                yield rows, []
+
+            stat = file_path.stat()
+            file_row = {
+                "path": str(file_path),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "track_id": None,
+            }
+            yield {"files_init": [file_row]}, []
+
+    def _load_batch(self, rows: Dict[str, List[dict]]) -> None:
+        """Insert a batch of rows into the intermediary tables.
+
+        One multi-row insert (or COPY) is issued per table and the batch is committed
+        on the connection of the stage, together with its checkpoint.
+
+        Args:
+            rows: Rows per intermediary table.
+        """
+        with self._connection() as conn:
+            if self.loader == "copy":
+                # COPY bypasses SQLAlchemy, begin so that the commit below applies
+                if not conn.in_transaction():
+                    conn.begin()
+                with conn.connection.cursor() as cursor:
+                    for tbl, tbl_rows in rows.items():
+                        copy_rows(cursor, self.tables[tbl], tbl_rows, self.copy_format)
+                self._stage_stats().statements += len(rows)
+            else:
+                for tbl, tbl_rows in rows.items():
+                    conn.execute(self.tables[tbl].insert().values(tbl_rows))
+
+            self._save_checkpoint("run_initial_pipeline", batch=True)
             conn.commit()
 
+        # Manifest rows are bookkeeping, not output of the stage
+        self._stage_stats().rows_out += sum(
+            len(tbl_rows) for tbl, tbl_rows in rows.items() if tbl != "files_init"
+        )
+
+    def _load_batches(self, batches: Iterable[Batch]) -> int:
+        """Load batches into the intermediary tables.
+
+        Args:
+            batches: Rows and failures for each chunk of files.
+
+        Returns:
+            Number of songs loaded.
+        """
+        n_songs = 0
+
+        for rows, failures in batches:
+
+            for file_path, error in failures:
+                logging.warning("Failed to read %s: %s", file_path, error)
+
+            n_read = len(rows.get("songs_init", [])) + len(failures)
+            self._stage_stats().rows_in += n_read
+
+            if any(rows.values()):
+                self._load_batch(rows)
+                n_songs += len(rows.get("songs_init", []))
+
+        return n_songs
+
+    def _load_shards(self, batches: Iterable[Batch]) -> int:
+        """Load batches into the intermediary tables on `shards` connections.
+
+        Each worker thread takes the next batch from a shared queue, so the files are
+        partitioned by load rather than up front. Measurements of the workers are
+        merged into the stats of the stage.
+
+        Args:
+            batches: Rows and failures for each chunk of files.
+
+        Returns:
+            Number of songs loaded.
+        """
+        stats = self._stage_stats()
+        shared = SharedIterator(batches)
+
+        # Locks of the stage transaction (TRUNCATE, DROP INDEX) would block workers
+        self._conn.commit()
+
+        def load_shard(shard: int) -> Tuple[int, StageStats]:
+            shard_stats = StageStats(f"{stats.name}[{shard}]")
+            shard_stats.start()
+
+            with self._connection() as conn:
+                self._set_timeout(conn, stats.name)
+                conn.info["stage_stats"] = shard_stats
+                try:
+                    return self._load_batches(shared), shard_stats
+                except BaseException:
+                    # Stop the other workers
+                    shared.close()
+                    raise
+                finally:
+                    del conn.info["stage_stats"]
+                    shard_stats.stop()
+
+        with ThreadPoolExecutor(max_workers=self.shards) as executor:
+            futures = [executor.submit(load_shard, i) for i in range(self.shards)]
+
+        n_songs = 0
+
+        for future in futures:
+            shard_songs, shard_stats = future.result()
+            n_songs += shard_songs
+            stats.merge(shard_stats)
+
+        return n_songs
+
+    def _load_direct(self, rows: Dict[str, List[dict]]) -> None:
+        """Write rows of a direct load to the final tables, in the stage transaction.
+
+        Songs that exist already are updated and files are upserted into the
+        manifest, all other rows are loaded with COPY in the given order.
+
+        Args:
+            rows: Rows per final table.
+        """
+        with self._connection() as conn:
+            stats = self._stage_stats()
+
+            # COPY bypasses SQLAlchemy, begin so that the commit of the stage applies
+            if not conn.in_transaction():
+                conn.begin()
+
+            for tbl, tbl_rows in rows.items():
+                if not tbl_rows:
+                    continue
+
+                table = self.tables[tbl]
+
+                if tbl == "files":
+                    stmt = insert(table)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[table.c.path],
+                        set_={
+                            col: stmt.excluded[col]
+                            for col in tbl_rows[0]
+                            if col != "path"
+                        },
+                    )
+                    conn.execute(stmt, tbl_rows)
+                    continue
+
+                # Manifest rows above are bookkeeping, not output of the stage
+                stats.rows_out += len(tbl_rows)
+
+                if tbl == "songs":
+                    tbl_rows = self._update_songs(tbl_rows)
+
+                columns = [col.name for col in table.columns]
+                if tbl not in CLIENT_IDS:
+                    columns = None
+
+                with conn.connection.cursor() as cursor:
+                    copy_rows(cursor, table, tbl_rows, self.copy_format, columns)
+                stats.statements += 1
+
+    def _update_songs(self, rows: List[dict]) -> List[dict]:
+        """Update songs that exist already, by track id.
+
+        Args:
+            rows: Rows of the songs table.
+
+        Returns:
+            Rows of new songs.
+        """
+        songs = self.tables["songs"]
+
+        # Last row of each track
+        tracks = {row["track_id"]: row for row in rows}
+        new_rows = []
+
+        stmt = select(songs.c.track_id).where(songs.c.track_id.in_(list(tracks)))
+        existing = set(self._conn.execute(stmt).scalars())
+
+        updates = []
+        for track_id, row in tracks.items():
+            if track_id in existing:
+                updates.append({**row, "b_track_id": track_id})
+            else:
+                new_rows.append(row)
+
+        if updates:
+            stmt = songs.update().where(songs.c.track_id == bindparam("b_track_id"))
+            self._conn.execute(stmt, updates)
+
+        return new_rows
+
+    def _filter_ingested(self, file_paths: Iterable[Path]) -> Iterator[Path]:
+        """Skip files that were ingested before and have not changed since.
+
+        The files table is queried once per chunk of `batch_size` paths, on a separate
+        connection since this runs in the background thread of the initial pipeline.
+        Each query ends its transaction, so the connection does not hold locks or
+        snapshots while files are read. Files that cannot be stat'ed are passed on, to
+        be reported by `extract_rows`.
+
+        Args:
+            file_paths: Paths of h5 files.
+
+        Yields:
+            Paths of new or modified files.
+        """
+        files = self.tables["files"]
+
+        with self.engine.connect() as conn:
+            for chunk in chunked(file_paths, self.batch_size):
+                stmt = select(files.c.path, files.c.size, files.c.mtime).where(
+                    files.c.path.in_([str(file_path) for file_path in chunk])
+                )
+                ingested = {
+                    path: (size, mtime) for path, size, mtime in conn.execute(stmt)
+                }
+                conn.commit()
+
+                for file_path in chunk:
+                    try:
+                        stat = file_path.stat()
+                    except OSError:
+                        yield file_path
+                        continue
+                    if ingested.get(str(file_path)) != (stat.st_size, stat.st_mtime):
+                        yield file_path
+
+    def _filter_staged(self, file_paths: Iterable[Path]) -> Iterator[Path]:
+        """Skip files loaded into the intermediary tables by an interrupted run.
+
+        Like in `_filter_ingested`, each query on the separate connection ends its
+        transaction.
+
+        Args:
+            file_paths: Paths of h5 files.
+
+        Yields:
+            Paths of files that were not loaded yet.
+        """
+        files_init = self.tables["files_init"]
+
+        with self.engine.connect() as conn:
+            for chunk in chunked(file_paths, self.batch_size):
+                stmt = select(files_init.c.path).where(
+                    files_init.c.path.in_([str(file_path) for file_path in chunk])
+                )
+                staged = set(conn.execute(stmt).scalars())
+                conn.commit()
+
+                for file_path in chunk:
+                    if str(file_path) not in staged:
+                        yield file_path
+
+    def _load_checkpoints(self) -> Dict[str, Tuple[int, bool]]:
+        """Progress of the previous run.
+
+        Returns:
+            Number of committed batches and completion of each recorded stage.
+        """
+        rows = self._execute(text("SELECT stage, batches, completed FROM checkpoints"))
+        return {stage: (batches, completed) for stage, batches, completed in rows}
+
+    def _save_checkpoint(self, stage: str, batch: bool = False) -> None:
+        """Record progress of a stage in its transaction.
+
+        Batches are counted in the database, so concurrent connections can record
+        their batches.
+
+        Args:
+            stage: Name of the stage.
+            batch: Whether to count a committed batch instead of marking the stage as
+                completed.
+        """
+        if batch:
+            stmt = text(
+                """
+                INSERT INTO checkpoints (stage, batches)
+                VALUES (:stage, 1)
+                ON CONFLICT (stage) DO UPDATE SET batches = checkpoints.batches + 1;
+                """
+            ).bindparams(stage=stage)
+        else:
+            stmt = text(
+                """
+                INSERT INTO checkpoints (stage, completed)
+                VALUES (:stage, TRUE)
+                ON CONFLICT (stage) DO UPDATE SET completed = TRUE;
+                """
+            ).bindparams(stage=stage)
+
+        self._commit(stmt)
+
+    def _staging_lost(self) -> bool:
+        """Whether the intermediary tables lost the rows recorded by the checkpoints.
+
+        Unlogged tables are emptied when the database server crashes.
+
+        Returns:
+            True if the initial stage committed batches but songs_init is empty.
+        """
+        n_batches, _ = self._checkpoints.get("run_initial_pipeline", (0, False))
+        _, dropped = self._checkpoints.get("drop_init_tables", (0, False))
+
+        if not n_batches or dropped:
+            return False
+
+        return not self._execute(text("SELECT EXISTS (SELECT 1 FROM songs_init)"))[0][0]
+
+    def _prepare_staging(self) -> None:
+        """Set up the intermediary tables for the staging mode.
+
+        Unlogged and logged modes change the persistence of the tables, which is a
+        no-op if it is unchanged. Temp mode creates temp tables of the same name, which
+        shadow the regular tables on the shared connection.
+        """
+        for tbl in [tbl for tbl in self.tables if "init" in tbl]:
+            if self.staging == "temp":
+                stmt = f"CREATE TEMP TABLE {tbl} (LIKE {tbl} INCLUDING DEFAULTS)"
+            else:
+                stmt = f"ALTER TABLE {tbl} SET {self.staging.upper()}"
+            self._commit(text(stmt))
+
+        logging.info("Intermediary tables set up as %s tables.", self.staging)
+
+    def _run_stages(self, graph: Graph) -> None:
+        """Run the stages of the graph, skipping stages completed by a resumed run.
+
+        Args:
+            graph: Dependencies of each stage.
+        """
+        self._checkpoints = {}
+
+        if self.resume:
+            self._checkpoints = self._load_checkpoints()
+            if self._staging_lost():
+                logging.warning("Intermediary tables are empty, starting over.")
+                self._checkpoints = {}
+
+        if not self._checkpoints:
+            self._commit(text("DELETE FROM checkpoints"))
+
+        completed = {name for name, (_, done) in self._checkpoints.items() if done}
+        if completed:
+            logging.info("Resuming run, skipping stages: %s.", ", ".join(completed))
+
+        if not self.direct:
+            self._prepare_staging()
+
+        self._check_constraints()
+
+        def run_stage(name: str) -> None:
+            if name not in completed:
+                getattr(self, name)()
+
+        # Temp tables are only visible to the shared connection
+        max_workers = 1 if self.staging == "temp" else self.concurrent_stages
+
+        run_graph(graph, run_stage, max_workers)
+
+    def _check_constraints(self) -> None:
+        """Handle constraints of final tables missing after an interrupted bulk load.
+
+        A resumed bulk load keeps them deferred, and so does a bulk load into final
+        tables that are still empty. Otherwise they are restored before any stage
+        runs, since upserts rely on them.
+        """
+        self._deferred = False
+
+        if not any(self._missing_constraints().values()):
+            return
+
+        _, deferred = self._checkpoints.get("defer_final_constraints", (0, False))
+        self._deferred = True
+
+        if self.bulk and (deferred or self._final_tables_empty()):
+            logging.info("Constraints of the final tables stay deferred.")
+            return
+
+        logging.warning("Constraints of the final tables are missing, restoring them.")
+        self.restore_final_constraints()
+
+    def _final_tables_empty(self) -> bool:
+        """Whether all final tables with deferrable constraints are empty.
+
+        Returns:
+            True if none of the tables has rows.
+        """
+        return not any(
+            self._execute(text(f"SELECT EXISTS (SELECT 1 FROM {tbl})"))[0][0]
+            for tbl in DEFERRED_TABLES
+        )
+
+    def _on_conflict(self, clause: str) -> str:
+        """Conflict clause of an upsert, left out while constraints are deferred.
+
+        The final tables are empty then, and each stage inserts distinct rows.
+
+        Args:
+            clause: ON CONFLICT clause.
+
+        Returns:
+            The clause, or an empty string.
+        """
+        return "" if self._deferred else clause
+
+    def _missing_constraints(self) -> Dict[str, List[Any]]:
+        """Deferrable constraints and indexes of the final tables that do not exist.
+
+        Returns:
+            Missing constraints and indexes per table.
+        """
+        missing = {}
+
+        for tbl in DEFERRED_TABLES:
+            stmt = text(
+                """
+                SELECT conname
+                FROM pg_constraint
+                WHERE conrelid = CAST(:tbl AS regclass)
+                UNION
+                SELECT c.relname
+                FROM pg_index AS i
+                JOIN pg_class AS c ON c.oid = i.indexrelid
+                WHERE i.indrelid = CAST(:tbl AS regclass);
+                """
+            ).bindparams(tbl=tbl)
+            names = {name for name, in self._execute(stmt)}
+
+            indexes, foreign_keys = deferrable_constraints(self.tables[tbl])
+            missing[tbl] = [
+                item for item in indexes + foreign_keys if item.name not in names
+            ]
+
+        return missing
+
+    def _run_parallel(self, tasks: List[List[Executable]]) -> None:
+        """Run lists of statements in parallel, each on its own connection.
+
+        The statements of a list run in sequence and are committed one by one.
+
+        Args:
+            tasks: Lists of statements.
+        """
+        stats = self._stage_stats()
+
+        def run_task(stmts: List[Executable]) -> None:
+            with self.engine.connect() as conn:
+                self._set_timeout(conn, stats.name)
+                for stmt in stmts:
+                    conn.execute(stmt)
+                    conn.commit()
+
+        with ThreadPoolExecutor(max_workers=self.concurrent_stages) as executor:
+            futures = [
+                executor.submit(timed_call, run_task, stmts) for stmts in tasks if stmts
+            ]
+            for future in futures:
+                _, cpu_time = future.result()
+                stats.cpu_time += cpu_time
+
+        stats.statements += sum(len(stmts) for stmts in tasks)
+
+    def _run_sql(self, stmt: TextClause, source: str) -> Tuple[int, int]:
+        """Run and commit the statement of a SQL stage.
+
+        Returned rows are counted on the server. If `explain_dir` is set, the
+        statement is run with EXPLAIN ANALYZE instead, its plan is written to
+        `<explain_dir>/<stage>.txt` and the rows are counted from the plan.
+
+        Args:
+            stmt: Query to run, returning one row per inserted or updated row with
+                whether it was inserted (`RETURNING xmax = 0 AS inserted`).
+            source: Table the stage reads from, its rows are counted as rows in.
+
+        Returns:
+            Number of rows written and of rows inserted.
+        """
+        stats = self._stage_stats()
+        stats.rows_in = self._execute(text(f"SELECT COUNT(*) FROM {source}"))[0][0]
+
+        if self.explain_dir is None:
+            query = stmt.text.strip().rstrip(";")
+            count_stmt = text(
+                f"""
+                WITH written AS ({query})
+                SELECT COUNT(*), COUNT(*) FILTER (WHERE inserted)
+                FROM written;
+                """
+            )
+            n_written, n_inserted = self._execute(count_stmt)[0]
+            stats.rows_out = n_written
+            return n_written, n_inserted
+
+        explain_stmt = text(f"EXPLAIN (ANALYZE, BUFFERS) {stmt.text}")
+
+        plan = "\n".join(row[0] for row in self._execute(explain_stmt)) + "\n"
+
+        plan_path = self.explain_dir / f"{stats.name}.txt"
+        self.explain_dir.mkdir(parents=True, exist_ok=True)
+        plan_path.write_text(plan)
+
+        logging.info("Query plan of %s stage written to %s.", stats.name, plan_path)
+
+        n_written, n_inserted = plan_counts(plan)
+        stats.rows_out = n_written
+        return n_written, n_inserted
+
     def run(self) -> None:
         """Complete ETL pipeline.
 
         - Extract flat files, perform minimal transformations and load into intermediary tables
+        - Optionally load analysis arrays of each track
+        - Index intermediary tables
         - Insert into artists table
         - Insert into locations table
         - Create many-to-many mapping for artists and locations
         - Insert into songs table
+        - Record ingested files
         - Drop intermediary tables
+
+        Progress is recorded in the checkpoints table. With `resume`, stages completed
+        by the previous run are skipped and the initial stage continues after its last
+        committed batch; otherwise checkpoints and intermediary tables are cleared.
+        The intermediary tables are unlogged, temp or logged tables (see `staging`).
+
+        Connections of the run use the session settings of `profile`, which are reset
+        when they return to the pool.
+
+        With `bulk`, constraints and secondary indexes of empty final tables are
+        dropped before and rebuilt after they are loaded.
+
+        With `direct`, the final tables are loaded in a single stage instead (see
+        `run_direct_pipeline`).
+
+        Stages run as soon as the stages they depend on (see `STAGES`) completed, up to
+        `concurrent_stages` at the same time. The critical path, the chain of dependent
+        stages that bounds the runtime, is added to the run report.
+
+        Dimension tables are merged with upserts, so runs can be repeated and, with
+        `incremental`, only new or modified files are ingested. Measurements of each
+        stage are logged as a JSON run report and written to `report_path` if set.
         """
-        self.run_initial_pipeline()
-        self.run_artist_pipeline()
-        self.run_location_pipeline()
-        self.run_artist_location_pipeline()
-        self.run_album_pipeline()
-        self.run_song_pipeline()
-        self.drop_init_tables()
+        self.report = RunReport()
+        start = time.perf_counter()
+
+        graph = self._stage_graph()
+
+        event.listen(self.engine, "checkout", self._apply_profile)
+        event.listen(self.engine, "checkin", self._reset_profile)
+
+        try:
+            if self.staging == "temp":
+                self._shared_conn = self.engine.connect()
+
+            self._run_stages(graph)
+        finally:
+            if self._shared_conn is not None:
+                self._shared_conn.close()
+                self._shared_conn = None
+
+            event.remove(self.engine, "checkout", self._apply_profile)
+            event.remove(self.engine, "checkin", self._reset_profile)
+
+        self.report.wall_time = time.perf_counter() - start
+
+        durations = {stats.name: stats.wall_time for stats in self.report.stages}
+        path, path_time = critical_path(graph, durations)
+        self.report.critical_path = path
+        self.report.critical_path_time = path_time
+
+        logging.info(
+            "Critical path: %s (%.2fs of %.2fs).",
+            " -> ".join(path),
+            path_time,
+            self.report.wall_time,
+        )
+
+        logging.info("Run report:\n%s", self.report.to_json())
+
+        if self.report_path is not None:
+            self.report.write(self.report_path)
+
+    def _stage_graph(self) -> Graph:
+        """Stages of this run and their dependencies.
+
+        Returns:
+            Dependencies of each stage, without the analysis stage if it is disabled.
+        """
+        stages = DIRECT_STAGES if self.direct else STAGES
+        skipped = set() if self.analysis else {"run_analysis_pipeline"}
+
+        graph = {
+            name: tuple(dep for dep in deps if dep not in skipped)
+            for name, deps in stages.items()
+            if name not in skipped
+        }
 
+        if self.bulk:
+            for name, deps in BULK_STAGES.items():
+                graph[name] = graph.get(name, ()) + deps
+
+        return graph
+
+    @stage
     def run_initial_pipeline(self) -> None:
         """Initial ETL pipeline.
 
-        Minimal processing to load songs and artists into the database.
+        Minimal processing to load songs and artists into the database. Files are
+        discovered lazily and read in chunks of `batch_size`, optionally in parallel,
+        while previous chunks are loaded. Each chunk is loaded as one batch, with
+        `shards` concurrent connections if set. If `summary_file` is set, songs are
+        read from the aggregate file instead.
+
+        When resuming, files already in the intermediary tables (or, for the summary
+        file, the committed slices) are skipped. Otherwise the intermediary tables are
+        emptied first.
         """
         logging.info("Starting initial pipeline...")
 
-        file_paths = get_file_paths(Path("data"))
+        # Indexes are built after the load
+        self.drop_init_indexes()
 
-        for file_path in file_paths:
+        n_batches, _ = self._checkpoints.get("run_initial_pipeline", (0, False))
 
-            # Load individual file
-            song_df = read_h5(file_path)
-
-            # Insert artist
-            # fmt: off
-            insert_artist_stmt = (
-                self.tables["artists_init"].
-                insert().
-                values(
-                    name=encode_str(song_df.artist_name),
-                    location=encode_str(song_df.artist_location),
-                    latitude=cast_numeric(song_df.artist_latitude),
-                    longitude=cast_numeric(song_df.artist_longitude)
-                )
-            )
-            # fmt: on
-
-            self._commit(insert_artist_stmt)
-
-            # Insert song
-            # fmt:off
-            insert_song_stmt = (
-                self.tables["songs_init"].
-                insert().
-                values(
-                    title=encode_str(song_df.title),
-                    year=cast_numeric(song_df.year),
-                    danceability=cast_numeric(song_df.danceability),
-                    duration=cast_numeric(song_df.duration),
-                    end_of_fade_in=cast_numeric(song_df.end_of_fade_in),
-                    start_of_fade_out=cast_numeric(song_df.start_of_fade_out),
-                    loudness=cast_numeric(song_df.loudness),
-                    bpm=cast_numeric(song_df.tempo),
-                    album_name=encode_str(song_df.release),
-                    artist_name=encode_str(song_df.artist_name),
-                )
-            )
-            # fmt: on
+        if not self.resume:
+            init_tables = [tbl for tbl in self.tables if "init" in tbl]
+            self._commit(text(f"TRUNCATE {', '.join(init_tables)}"))
 
-            self._commit(insert_song_stmt)
+        if self.summary_file is None:
+            file_paths = get_file_paths(self.data_dir)
+            extract_batches = self._extract_batches
+        else:
+            file_paths = [self.summary_file.resolve()]
+            extract_batches = self._summary_batches
 
-        logging.info("Initial ETL pipeline successfully run!")
+        if self.incremental:
+            file_paths = self._filter_ingested(file_paths)
 
-    def run_artist_pipeline(self) -> None:
-        """Insert into artists table."""
-        stmt = text(
-            """
-            INSERT INTO artists (name)
-            SELECT DISTINCT name
-            FROM artists_init
-            WHERE name IS NOT NULL;
-            """
+        if self.resume and self.summary_file is None:
+            file_paths = self._filter_staged(file_paths)
+
+        batches = extract_batches(file_paths)
+
+        if self.resume and self.summary_file is not None:
+            batches = islice(batches, n_batches, None)
+
+        # Discovery, reading and transformation run in a background thread, which is
+        # stopped if loading fails
+        batches = self._prefetch(batches)
+
+        with closing(batches):
+            if self.shards > 1:
+                n_songs = self._load_shards(batches)
+            else:
+                n_songs = self._load_batches(batches)
+
+        logging.info("Initial ETL pipeline successfully run on %d songs!", n_songs)
+
+    @stage
+    def run_analysis_pipeline(self) -> None:
+        """Load the per-track analysis arrays into the track analysis table.
+
+        Files are read in chunks of `analysis_batch_size`, optionally in parallel, and
+        each chunk is streamed with a binary COPY. Earlier rows of the same tracks are
+        replaced.
+        """
+        logging.info("Starting analysis pipeline...")
+
+        analysis = self.tables["track_analysis"]
+
+        file_paths = get_file_paths(self.data_dir)
+
+        if self.incremental:
+            file_paths = self._filter_ingested(file_paths)
+
+        n_tracks = 0
+
+        batches = self._prefetch(
+            self._map_chunks(
+                extract_analysis,
+                file_paths,
+                self.analysis_batch_size,
+                self._stage_stats(),
+            )
         )
 
-        self._commit(stmt)
+        with closing(batches):
+            for rows, failures in batches:
 
-        logging.info("Artists table cleaned!")
+                for file_path, error in failures:
+                    logging.warning("Failed to read %s: %s", file_path, error)
 
-    def run_location_pipeline(self) -> None:
-        """Insert into locations table."""
-        logging.info("Starting pipeline to clean locations table...")
+                if not rows:
+                    continue
+
+                with self._connection() as conn:
+                    track_ids = [row["track_id"] for row in rows]
+                    conn.execute(
+                        analysis.delete().where(analysis.c.track_id.in_(track_ids))
+                    )
+                    with conn.connection.cursor() as cursor:
+                        copy_rows(cursor, analysis, rows, "binary")
+                    conn.commit()
+
+                n_tracks += len(rows)
 
-        stmt = select(self.tables["artists_init"].c.location.distinct())
+                stats = self._stage_stats()
+                stats.rows_in += len(rows) + len(failures)
+                stats.rows_out += len(rows)
+                stats.statements += 1
 
-        res = self._execute(stmt)
+        logging.info("Analysis pipeline successfully run on %d tracks!", n_tracks)
 
-        locations = [row[0] for row in res.all()]
+    @stage
+    def run_direct_pipeline(self) -> None:
+        """Load the final tables directly, without intermediary tables.
 
-        def get_lng_lat_val(col: Column, location: str) -> list | None:
-            """Helper to insert unique latitude and longitude values only.
+        Files are read in chunks of `batch_size` like in the initial pipeline, except
+        that files in the manifest are always skipped. Artists and albums of each
+        chunk are deduplicated in memory (see `DirectLoad`) and loaded with its songs;
+        locations and the artist-location mapping follow once all files are read. The
+        final tables are locked and loaded in one transaction, so the ids assigned by
+        the client cannot collide. Sequences are advanced past these ids at the end.
+        """
+        logging.info("Starting direct pipeline...")
 
-            Args:
-                col: Column object for latitude or longitude
-                location: Single location as a string
+        if self.summary_file is None:
+            file_paths = get_file_paths(self.data_dir)
+            extract_batches = self._extract_batches
+        else:
+            file_paths = [self.summary_file.resolve()]
+            extract_batches = self._summary_batches
 
-            Returns:
-                Latitude or longitude value if it is unique for a location and else None.
-            """
-            stmt = select(col).where(self.tables["artists_init"].c.location == location)
+        tbls = ["artists", "locations", "artists_locations", "albums", "songs", "files"]
+        self._commit(text(f"LOCK TABLE {', '.join(tbls)} IN SHARE ROW EXCLUSIVE MODE"))
 
-            res = self._execute(stmt)
+        direct_load = DirectLoad()
+        with self._connection() as conn:
+            direct_load.load_existing(conn)
 
-            val = [row[0] for row in res.all()]
-            val = list(set(val))
-            insert_val = val[0] if len(val) == 1 else None
+        n_songs = 0
 
-            return insert_val
+        batches = self._prefetch(extract_batches(self._filter_ingested(file_paths)))
 
-        for location in locations:
+        with closing(batches):
+            for rows, failures in batches:
 
-            if location is None:
-                continue
+                for file_path, error in failures:
+                    logging.warning("Failed to read %s: %s", file_path, error)
+
+                song_rows = rows.get("songs_init", [])
+                self._stage_stats().rows_in += len(song_rows) + len(failures)
+
+                new_rows = direct_load.add_batch(
+                    rows.get("artists_init", []), song_rows
+                )
+                new_rows["files"] = rows.get("files_init", [])
+                self._load_direct(new_rows)
 
-            lat = get_lng_lat_val(self.tables["artists_init"].c.latitude, location)
-            lng = get_lng_lat_val(self.tables["artists_init"].c.longitude, location)
+                n_songs += len(song_rows)
 
-            insert_loc_stmt = (
-                self.tables["locations"]
-                .insert()
-                .values(name=location, latitude=lat, longitude=lng)
+        self._load_direct(direct_load.finish())
+
+        if direct_load.n_skipped:
+            logging.warning(
+                "Skipped %d songs without a track id.", direct_load.n_skipped
             )
 
-            self._commit(insert_loc_stmt)
+        for tbl in CLIENT_IDS:
+            self._commit(
+                text(
+                    f"""
+                    SELECT setval(
+                        pg_get_serial_sequence('{tbl}', 'id'),
+                        COALESCE(MAX(id), 1),
+                        MAX(id) IS NOT NULL
+                    )
+                    FROM {tbl};
+                    """
+                )
+            )
 
-        logging.info("Locations table cleaned!")
+        logging.info("Direct pipeline successfully run on %d songs!", n_songs)
 
-    def run_artist_location_pipeline(self) -> None:
-        """Many-to-many relationship table for artists and locations."""
-        logging.info(
-            "Starting pipeline for many-to-many mapping of artists and locations."
+    @stage
+    def run_artist_pipeline(self) -> None:
+        """Insert into artists table."""
+        on_conflict = self._on_conflict("ON CONFLICT (name) DO NOTHING")
+
+        stmt = text(
+            f"""
+            INSERT INTO artists (name)
+            SELECT DISTINCT name
+            FROM artists_init
+            WHERE name IS NOT NULL
+            {on_conflict}
+            RETURNING xmax = 0 AS inserted;
+            """
         )
 
-        artist_stmt = select(self.tables["artists"].c.id, self.tables["artists"].c.name)
+        _, n_inserted = self._run_sql(stmt, "artists_init")
 
-        res = self._execute(artist_stmt)
+        logging.info("Artists table cleaned! %d new artists.", n_inserted)
 
-        artist_names = res.all()
+    @stage
+    def run_location_pipeline(self) -> None:
+        """Insert into locations table.
 
-        for artist_id, artist_name in artist_names:
+        Latitude and longitude are only kept if they are unique (and not missing) for a
+        location.
+        """
+        logging.info("Starting pipeline to clean locations table...")
 
-            # Get the location of that artist
-            loc_stmt = select(self.tables["artists_init"].c.location).where(
-                self.tables["artists_init"].c.name == artist_name
-            )
+        on_conflict = self._on_conflict("ON CONFLICT (name) DO NOTHING")
 
-            self._execute(loc_stmt)
+        stmt = text(
+            f"""
+            INSERT INTO locations (name, latitude, longitude)
+            SELECT
+                location,
+                CASE
+                    WHEN COUNT(DISTINCT latitude) = 1 AND COUNT(latitude) = COUNT(*)
+                    THEN MIN(latitude)
+                END,
+                CASE
+                    WHEN COUNT(DISTINCT longitude) = 1 AND COUNT(longitude) = COUNT(*)
+                    THEN MIN(longitude)
+                END
+            FROM artists_init
+            WHERE location IS NOT NULL
+            GROUP BY location
+            {on_conflict}
+            RETURNING xmax = 0 AS inserted;
+            """
+        )
 
-            loc = list(set(res.all()))
-            loc_val = loc[0][0] if len(loc) == 1 else None
+        _, n_inserted = self._run_sql(stmt, "artists_init")
 
-            if loc_val is None:
-                continue
+        logging.info("Locations table cleaned! %d new locations.", n_inserted)
 
-            loc_id_stmt = select(self.tables["locations"].c.id).where(
-                self.tables["locations"].c.name == loc_val
-            )
+    @stage
+    def run_artist_location_pipeline(self) -> None:
+        """Many-to-many relationship table for artists and locations.
 
-            self._execute(loc_id_stmt)
+        An artist is mapped to a location if all of its rows share the same, non-missing
+        location.
+        """
+        logging.info(
+            "Starting pipeline for many-to-many mapping of artists and locations."
+        )
 
-            location_id = res.scalar()
+        on_conflict = self._on_conflict(
+            "ON CONFLICT (artist_id, location_id) DO NOTHING"
+        )
 
-            insert_stmt = (
-                self.tables["artists_locations"]
-                .insert()
-                .values(artist_id=artist_id, location_id=location_id)
-            )
+        stmt = text(
+            f"""
+            INSERT INTO artists_locations (artist_id, location_id)
+            SELECT a.id, l.id
+            FROM (
+                SELECT name, MIN(location) AS location
+                FROM artists_init
+                WHERE name IS NOT NULL
+                GROUP BY name
+                HAVING COUNT(DISTINCT location) = 1 AND COUNT(location) = COUNT(*)
+            ) AS ai
+            JOIN artists AS a ON a.name = ai.name
+            JOIN locations AS l ON l.name = ai.location
+            {on_conflict}
+            RETURNING xmax = 0 AS inserted;
+            """
+        )
 
-            self._commit(insert_stmt)
+        _, n_inserted = self._run_sql(stmt, "artists_init")
 
-        logging.info("Mapping table finished!")
+        logging.info("Mapping table finished! %d new mappings.", n_inserted)
 
+    @stage
     def run_album_pipeline(self) -> None:
-        """Insert into albums table."""
+        """Insert into albums table.
+
+        NULLs are distinct in the unique index on title and artist, so albums without
+        an artist are checked for explicitly.
+        """
         logging.info("Starting pipeline to clean albums table...")
 
+        on_conflict = self._on_conflict("ON CONFLICT (title, artist_id) DO NOTHING")
+
         stmt = text(
-            """
+            f"""
             INSERT INTO albums (title, artist_id)
-            SELECT DISTINCT album_name, (SELECT id FROM artists AS a WHERE a.name = s.artist_name)
-            FROM songs_init AS s;
+            SELECT DISTINCT s.album_name, a.id
+            FROM songs_init AS s
+            LEFT JOIN artists AS a ON a.name = s.artist_name
+            WHERE s.album_name IS NOT NULL AND (
+                a.id IS NOT NULL OR NOT EXISTS (
+                    SELECT 1
+                    FROM albums AS al
+                    WHERE al.title = s.album_name AND al.artist_id IS NULL
+                )
+            )
+            {on_conflict}
+            RETURNING xmax = 0 AS inserted;
             """
         )
 
-        self._commit(stmt)
+        _, n_inserted = self._run_sql(stmt, "songs_init")
 
-        logging.info("Album table cleaned!")
+        logging.info("Album table cleaned! %d new albums.", n_inserted)
 
+    @stage
     def run_song_pipeline(self) -> None:
-        """Insert into songs table."""
-        stmt = text(
+        """Insert into songs table, updating songs that were ingested before.
+
+        Of several files with the same track id, e.g. from overlapping subsets of the
+        dataset, the last one loaded is kept, like in `_update_songs`. Songs without a
+        track id are skipped, since a rerun could not match them to the loaded songs.
+        """
+        on_conflict = self._on_conflict(
+            """
+            ON CONFLICT (track_id) DO UPDATE SET
+                title = EXCLUDED.title,
+                year = EXCLUDED.year,
+                danceability = EXCLUDED.danceability,
+                duration = EXCLUDED.duration,
+                end_of_fade_in = EXCLUDED.end_of_fade_in,
+                start_of_fade_out = EXCLUDED.start_of_fade_out,
+                loudness = EXCLUDED.loudness,
+                bpm = EXCLUDED.bpm,
+                album_id = EXCLUDED.album_id,
+                artist_id = EXCLUDED.artist_id
             """
+        )
+
+        stmt = text(
+            f"""
             INSERT INTO songs (
+                track_id,
                 title,
                 year,
                 danceability,
@@ -259,37 +1771,167 @@ class Pipeline:
                 artist_id
             )
             SELECT
-                title,
-                year,
-                danceability,
-                duration,
-                end_of_fade_in,
-                start_of_fade_out,
-                loudness,
-                bpm,
-                (
-                    SELECT id
-                    FROM albums
-                    WHERE (albums.title = s.album_name) AND (
-                        (SELECT name FROM artists WHERE artists.id = albums.artist_id)
-                        = s.artist_name
-                    )
-                ),
-                (
-                    SELECT id
-                    FROM artists
-                    WHERE artists.name = s.artist_name
-                )
-            FROM songs_init AS s
+                s.track_id,
+                s.title,
+                s.year,
+                s.danceability,
+                s.duration,
+                s.end_of_fade_in,
+                s.start_of_fade_out,
+                s.loudness,
+                s.bpm,
+                al.id,
+                a.id
+            FROM (
+                SELECT DISTINCT ON (track_id) *
+                FROM songs_init
+                WHERE track_id IS NOT NULL
+                ORDER BY track_id, id DESC
+            ) AS s
+            LEFT JOIN artists AS a ON a.name = s.artist_name
+            LEFT JOIN albums AS al ON al.title = s.album_name AND al.artist_id = a.id
+            {on_conflict}
+            RETURNING xmax = 0 AS inserted;
             """
         )
 
-        self._commit(stmt)
+        # xmax of a row is 0 unless it was updated by the upsert
+        n_written, n_inserted = self._run_sql(stmt, "songs_init")
+
+        n_skipped = self._execute(
+            text("SELECT COUNT(*) FROM songs_init WHERE track_id IS NULL")
+        )[0][0]
+        if n_skipped:
+            logging.warning("Skipped %d songs without a track id.", n_skipped)
+
+        logging.info(
+            "Songs table cleaned! %d new, %d updated songs.",
+            n_inserted,
+            n_written - n_inserted,
+        )
+
+    @stage
+    def run_file_pipeline(self) -> None:
+        """Record ingested files, once their songs are in the final tables."""
+        stmt = text(
+            """
+            INSERT INTO files (path, size, mtime, track_id)
+            SELECT path, size, mtime, track_id
+            FROM files_init
+            ON CONFLICT (path) DO UPDATE SET
+                size = EXCLUDED.size,
+                mtime = EXCLUDED.mtime,
+                track_id = EXCLUDED.track_id
+            RETURNING xmax = 0 AS inserted;
+            """
+        )
+
+        self._run_sql(stmt, "files_init")
+
+        logging.info("Files table updated!")
+
+    @stage
+    def defer_final_constraints(self) -> None:
+        """Drop constraints and secondary indexes of the final tables for a bulk load.
+
+        Foreign keys, unique constraints and secondary indexes are dropped, so the SQL
+        stages insert without maintaining them, and without conflict clauses, until
+        `restore_final_constraints` builds them. Constraints are only deferred if all
+        final tables are empty, since upserts rely on them otherwise.
+        """
+        if self._deferred:
+            logging.info("Constraints of the final tables are deferred already.")
+            return
+
+        if not self._final_tables_empty():
+            logging.info("Final tables are not empty, constraints are kept.")
+            return
+
+        constraints = {
+            tbl: deferrable_constraints(self.tables[tbl]) for tbl in DEFERRED_TABLES
+        }
+
+        # Foreign keys first, they may depend on unique constraints
+        for _, foreign_keys in constraints.values():
+            for constraint in foreign_keys:
+                self._commit(DropConstraint(constraint))
+
+        for indexes, _ in constraints.values():
+            for index in indexes:
+                if isinstance(index, UniqueConstraint):
+                    self._commit(DropConstraint(index))
+                else:
+                    self._commit(DropIndex(index))
+
+        self._deferred = True
+
+        logging.info("Constraints of the final tables deferred.")
+
+    @stage
+    def restore_final_constraints(self) -> None:
+        """Build the constraints and indexes deferred by a bulk load.
+
+        Indexes and unique constraints of different tables are built in parallel, on
+        separate connections. Foreign keys are then added as NOT VALID, which does not
+        scan the tables, and validated in parallel, which does not block writes.
+        """
+        if not self._deferred:
+            return
+
+        missing = self._missing_constraints()
+        dialect = self.engine.dialect
+
+        index_tasks, foreign_key_tasks = [], []
+
+        for tbl, items in missing.items():
+            index_tasks.append(
+                [
+                    AddConstraint(item)
+                    if isinstance(item, UniqueConstraint)
+                    else CreateIndex(item)
+                    for item in items
+                    if not isinstance(item, ForeignKeyConstraint)
+                ]
+            )
+            for item in items:
+                if isinstance(item, ForeignKeyConstraint):
+                    add_stmt = AddConstraint(item).compile(dialect=dialect)
+                    foreign_key_tasks.append(
+                        [
+                            text(f"{add_stmt} NOT VALID"),
+                            text(f"ALTER TABLE {tbl} VALIDATE CONSTRAINT {item.name}"),
+                        ]
+                    )
+
+        self._run_parallel(index_tasks)
+        self._run_parallel(foreign_key_tasks)
+
+        self._deferred = False
+
+        logging.info("Constraints of the final tables restored.")
+
+    @stage
+    def create_init_indexes(self) -> None:
+        """Index and analyze intermediary tables for the downstream stages."""
+        for index_name, (tbl, cols) in init_indexes.items():
+            cols = ", ".join(cols)
+            self._commit(
+                text(f"CREATE INDEX IF NOT EXISTS {index_name} ON {tbl} ({cols})")
+            )
+
+        for tbl in sorted({tbl for tbl, _ in init_indexes.values()}):
+            self._commit(text(f"ANALYZE {tbl}"))
+
+        logging.info("Initial tables indexed.")
 
-        logging.info("Songs table cleaned!")
+    def drop_init_indexes(self) -> None:
+        """Drop indexes of intermediary tables, e.g. left over from a previous run."""
+        for index_name in init_indexes:
+            self._commit(text(f"DROP INDEX IF EXISTS {index_name}"))
 
+    @stage
     def drop_init_tables(self) -> None:
-        """Drop initial tables."""
+        """Drop initial tables (and with them their indexes)."""
         init_tables = [
             tbl_name for tbl_name in self.tables.keys() if "init" in tbl_name
         ]
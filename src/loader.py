@@ -0,0 +1,304 @@
+"""Bulk loading with PostgreSQL COPY."""
+import io
+import math
+import struct
+from decimal import Decimal
+from typing import Any, Callable, Iterable, Iterator, List
+
+import numpy as np
+from sqlalchemy import ARRAY, BigInteger, Float, Integer, Numeric, Table
+
+COPY_FORMATS = ("text", "binary")
+
+# Bytes sent to the server per read of the COPY data
+COPY_BUFFER_SIZE = 1 << 20
+
+# Type OID of float8, the element type of float arrays
+FLOAT8_OID = 701
+
+# Header of the binary COPY format: signature, flags and header extension length
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_TRAILER = struct.pack(">h", -1)
+
+# Sign words of the binary numeric format
+NUMERIC_POS = 0x0000
+NUMERIC_NEG = 0x4000
+NUMERIC_NAN = 0xC000
+NUMERIC_PINF = 0xD000
+NUMERIC_NINF = 0xF000
+
+
+def copy_columns(table: Table) -> List[str]:
+    """Columns filled by COPY, i.e. all columns except an integer primary key.
+
+    Args:
+        table: Table to load.
+
+    Returns:
+        Column names in table order.
+    """
+    return [
+        col.name
+        for col in table.columns
+        if not (col.primary_key and isinstance(col.type, Integer))
+    ]
+
+
+def encode_numeric(val: int | float | Decimal) -> bytes:
+    """Encode a number in the binary format of the PostgreSQL numeric type.
+
+    Args:
+        val: Number to encode.
+
+    Returns:
+        Binary representation without the length prefix.
+    """
+    if isinstance(val, float):
+        if math.isnan(val):
+            return struct.pack(">hhHh", 0, 0, NUMERIC_NAN, 0)
+        if math.isinf(val):
+            sign = NUMERIC_PINF if val > 0 else NUMERIC_NINF
+            return struct.pack(">hhHh", 0, 0, sign, 0)
+        val = Decimal(repr(val))
+
+    sign, digits, exponent = Decimal(val).as_tuple()
+
+    # Decimal digits of the integer val * 10 ** dscale
+    dscale = max(-exponent, 0)
+    digits = list(digits) + [0] * max(exponent, 0)
+
+    # Align the decimal point to groups of four digits (base 10000)
+    digits += [0] * (-dscale % 4)
+    digits = [0] * (-len(digits) % 4) + digits
+    groups = [
+        digits[i] * 1000 + digits[i + 1] * 100 + digits[i + 2] * 10 + digits[i + 3]
+        for i in range(0, len(digits), 4)
+    ]
+    weight = len(groups) - (dscale + 3) // 4 - 1
+
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+
+    return struct.pack(
+        f">hhHh{len(groups)}H",
+        len(groups),
+        weight,
+        NUMERIC_NEG if sign else NUMERIC_POS,
+        dscale,
+        *groups,
+    )
+
+
+def encode_float_array(val: np.ndarray) -> bytes:
+    """Encode an array in the binary format of the PostgreSQL float8[] type.
+
+    Args:
+        val: Array of any shape.
+
+    Returns:
+        Binary representation without the length prefix.
+    """
+    arr = np.asarray(val, dtype=">f8")
+
+    if arr.size == 0:
+        return struct.pack(">iii", 0, 0, FLOAT8_OID)
+
+    dims = [v for size in arr.shape for v in (size, 1)]
+    header = struct.pack(f">iii{len(dims)}i", arr.ndim, 0, FLOAT8_OID, *dims)
+
+    # Every element is prefixed with its length
+    elems = np.empty(arr.size, dtype=[("len", ">i4"), ("val", ">f8")])
+    elems["len"] = 8
+    elems["val"] = arr.ravel()
+
+    return header + elems.tobytes()
+
+
+def binary_encoder(table: Table, column: str) -> Callable[[Any], bytes]:
+    """Encoder of a non-null value for the binary COPY format.
+
+    Args:
+        table: Table to load.
+        column: Name of the column.
+
+    Returns:
+        Function mapping a value to its binary representation.
+    """
+    col_type = table.c[column].type
+
+    if isinstance(col_type, ARRAY) and isinstance(col_type.item_type, Float):
+        return encode_float_array
+    if isinstance(col_type, BigInteger):
+        return struct.Struct(">q").pack
+    if isinstance(col_type, Integer):
+        return struct.Struct(">i").pack
+    if isinstance(col_type, Float):
+        return struct.Struct(">d").pack
+    if isinstance(col_type, Numeric):
+        return encode_numeric
+
+    return lambda val: str(val).encode("utf8")
+
+
+def encode_text_value(val: Any) -> str:
+    r"""Encode a single value for the text COPY format.
+
+    Args:
+        val: Value to encode.
+
+    Returns:
+        Escaped value, \N for NULL.
+    """
+    if val is None:
+        return "\\N"
+
+    if isinstance(val, str):
+        return (
+            val.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+
+    return repr(val) if isinstance(val, float) else str(val)
+
+
+def encode_text(
+    table: Table, rows: Iterable[dict], columns: List[str] | None = None
+) -> Iterator[bytes]:
+    """Encode rows in the text COPY format.
+
+    Args:
+        table: Table to load.
+        rows: Rows keyed by column name.
+        columns: Columns to encode, defaults to `copy_columns(table)`.
+
+    Yields:
+        COPY data, one line per row.
+    """
+    columns = columns or copy_columns(table)
+
+    for row in rows:
+        line = "\t".join(encode_text_value(row[col]) for col in columns) + "\n"
+        yield line.encode("utf8")
+
+
+def encode_binary(
+    table: Table, rows: Iterable[dict], columns: List[str] | None = None
+) -> Iterator[bytes]:
+    """Encode rows in the binary COPY format.
+
+    Args:
+        table: Table to load.
+        rows: Rows keyed by column name.
+        columns: Columns to encode, defaults to `copy_columns(table)`.
+
+    Yields:
+        COPY data: header, one tuple per row and trailer.
+    """
+    columns = columns or copy_columns(table)
+    encoders = [binary_encoder(table, col) for col in columns]
+    null = struct.pack(">i", -1)
+    field_count = struct.pack(">h", len(columns))
+
+    yield BINARY_HEADER
+
+    for row in rows:
+        parts = [field_count]
+        for col, encode in zip(columns, encoders):
+            val = row[col]
+            if val is None:
+                parts.append(null)
+                continue
+            data = encode(val)
+            parts.append(struct.pack(">i", len(data)))
+            parts.append(data)
+        yield b"".join(parts)
+
+    yield BINARY_TRAILER
+
+
+class IterStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte strings.
+
+    Lets COPY stream data that is encoded on the fly instead of buffered in memory.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        """Initialize stream.
+
+        Args:
+            chunks: Byte strings to read.
+        """
+        self._chunks = iter(chunks)
+        self._buf = memoryview(b"")
+
+    def readable(self) -> bool:
+        """Whether the stream is readable."""
+        return True
+
+    def readinto(self, b: Any) -> int:
+        """Fill a buffer with the next bytes of the stream.
+
+        Args:
+            b: Writable buffer.
+
+        Returns:
+            Number of bytes read, 0 at the end of the stream.
+        """
+        view = memoryview(b).cast("B")
+        n_read = 0
+
+        while n_read < len(view):
+            if not self._buf:
+                try:
+                    self._buf = memoryview(next(self._chunks))
+                except StopIteration:
+                    break
+            n = min(len(view) - n_read, len(self._buf))
+            view[n_read : n_read + n] = self._buf[:n]
+            self._buf = self._buf[n:]
+            n_read += n
+
+        return n_read
+
+
+def copy_rows(
+    cursor: Any,
+    table: Table,
+    rows: Iterable[dict],
+    fmt: str = "text",
+    columns: List[str] | None = None,
+) -> None:
+    """Load rows into a table with COPY ... FROM STDIN.
+
+    Rows are encoded while they are streamed to the server.
+
+    Args:
+        cursor: psycopg2 cursor; the caller is responsible for committing.
+        table: Table to load.
+        rows: Rows keyed by column name.
+        fmt: COPY format, text or binary.
+        columns: Columns to load, defaults to `copy_columns(table)`, e.g. to load
+            primary keys assigned by the client.
+    """
+    if fmt not in COPY_FORMATS:
+        raise ValueError(f"Unknown COPY format: {fmt}")
+
+    columns = columns or copy_columns(table)
+
+    if fmt == "binary":
+        data = encode_binary(table, rows, columns)
+    else:
+        data = encode_text(table, rows, columns)
+
+    stmt = (
+        f"COPY {table.name} ({', '.join(columns)}) " f"FROM STDIN WITH (FORMAT {fmt})"
+    )
+
+    cursor.copy_expert(stmt, IterStream(data), size=COPY_BUFFER_SIZE)
@@ -1,39 +1,154 @@
 """Functions to read local files."""
+import os
+from fnmatch import fnmatchcase
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, Iterator, List, Tuple
 
 import h5py
 import numpy as np
-import pandas as pd
 
+# Fields of the compound song tables used by the pipeline, per group
+SONG_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "analysis/songs": (
+        "danceability",
+        "duration",
+        "end_of_fade_in",
+        "start_of_fade_out",
+        "loudness",
+        "tempo",
+        "track_id",
+    ),
+    "metadata/songs": (
+        "artist_name",
+        "artist_location",
+        "artist_latitude",
+        "artist_longitude",
+        "release",
+        "title",
+    ),
+    "musicbrainz/songs": ("year",),
+}
 
-def get_file_paths(data_dir: Path, pattern: str = "*.h5") -> List[Path]:
+# Variable-length analysis arrays, indexed by the idx_<name> fields of analysis/songs
+ANALYSIS_ARRAYS = (
+    "segments_timbre",
+    "segments_pitches",
+    "segments_loudness_max",
+    "beats_start",
+    "bars_start",
+    "tatums_start",
+    "sections_start",
+)
+
+
+def get_file_paths(data_dir: Path, pattern: str = "*.h5") -> Iterator[Path]:
     """Recursive pattern matching in the data directory.
 
+    Directories are walked lazily with `os.scandir`, so paths are yielded while the
+    search is still running. Symbolic links to directories are not followed.
+
     Args:
         data_dir (Path): Path to directory to seach recursively.
         pattern (str): Pattern used in the search.
 
+    Yields:
+        Path: Absolute paths of matching files
+    """
+    dirs = [str(data_dir.resolve())]
+
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif fnmatchcase(entry.name, pattern):
+                    yield Path(entry.path)
+
+
+def read_h5(
+    file_path: Path, fields: Dict[str, Tuple[str, ...]] = SONG_FIELDS
+) -> Dict[str, Any]:
+    """Read the requested fields of a single h5 file.
+
+    The file is opened once and only the requested fields of the first row of each
+    compound dataset are read.
+
+    Args:
+        file_path (Path): Path to an h5 file.
+        fields (Dict[str, Tuple[str, ...]]): Fields to read, per compound dataset.
+
     Returns:
-        List[Path]: Paths of matching files
+        Dict[str, Any]: Mapping of field name to (numpy) scalar value.
+    """
+    record = {}
+
+    with h5py.File(file_path, "r") as hf:
+        for item, names in fields.items():
+            row = hf[item].fields(list(names))[0]
+            record.update(zip(names, row.tolist()))
+
+    return record
+
+
+def read_summary(
+    file_path: Path,
+    fields: Dict[str, Tuple[str, ...]] = SONG_FIELDS,
+    chunk_size: int = 10000,
+) -> Iterator[Dict[str, np.ndarray]]:
+    """Read the requested fields of an aggregate summary file in row slices.
+
+    The summary file of the dataset holds the compound song tables of all tracks, so
+    each slice is read with one hyperslab selection per table.
+
+    Args:
+        file_path (Path): Path to the summary h5 file.
+        fields (Dict[str, Tuple[str, ...]]): Fields to read, per compound dataset.
+        chunk_size (int): Number of rows per slice.
+
+    Yields:
+        Dict[str, np.ndarray]: Mapping of field name to column of values.
     """
-    return [file_path.resolve() for file_path in data_dir.rglob(pattern)]
+    with h5py.File(file_path, "r") as hf:
+        n_rows = min(hf[item].shape[0] for item in fields)
 
+        for start in range(0, n_rows, chunk_size):
+            stop = min(start + chunk_size, n_rows)
+            songs = {}
 
-def read_h5(file_path: Path) -> pd.DataFrame:
-    """Read a single h5 file and convert it to a DataFrame.
+            for item, names in fields.items():
+                data = hf[item].fields(list(names))[start:stop]
+                songs.update((name, data[name]) for name in names)
+
+            yield songs
+
+
+def read_analysis(file_path: Path) -> List[Dict[str, Any]]:
+    """Read the analysis arrays of each track in an h5 file.
+
+    The arrays of all tracks of a file are stored back to back in the analysis group;
+    the idx_<name> fields of analysis/songs hold the offset of each track.
 
     Args:
         file_path (Path): Path to an h5 file.
 
     Returns:
-        pd.DataFrame: Data from h5 file as a DataFrame.
+        List[Dict[str, Any]]: Track id and arrays of each track.
     """
-    df_list = []
-    items = ["analysis/songs", "metadata/songs", "musicbrainz/songs"]
+    with h5py.File(file_path, "r") as hf:
+        idx_fields = [f"idx_{name}" for name in ANALYSIS_ARRAYS]
+        songs = hf["analysis/songs"].fields(["track_id"] + idx_fields)[:]
+        arrays = {name: hf["analysis"][name][:] for name in ANALYSIS_ARRAYS}
+
+    tracks = []
+
+    for i, song in enumerate(songs):
+        track = {"track_id": song["track_id"]}
+
+        for name, arr in arrays.items():
+            start = song[f"idx_{name}"]
+            stop = songs[f"idx_{name}"][i + 1] if i + 1 < len(songs) else len(arr)
+            track[name] = arr[start:stop]
 
-    for item in items:
-        with h5py.File(file_path, "r") as hf:
-            df_list.append(pd.DataFrame(np.array(hf.get(item))))
+        tracks.append(track)
 
-    return pd.concat(df_list, axis="columns")
+    return tracks
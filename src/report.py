@@ -0,0 +1,106 @@
+"""Timings and throughput of pipeline runs."""
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+
+@dataclass
+class StageStats:
+    """Measurements of a single stage.
+
+    CPU time is that of the thread running the stage, plus the CPU time of the
+    threads and worker processes working for it, which is added to `cpu_time`
+    before the clocks stop.
+    """
+
+    name: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    rows_in: int = 0
+    rows_out: int = 0
+    statements: int = 0
+    _start: float = field(default=0.0, repr=False)
+    _cpu_start: float = field(default=0.0, repr=False)
+
+    @property
+    def rows_per_sec(self) -> float:
+        """Output rows per second of wall time."""
+        return self.rows_out / self.wall_time if self.wall_time else 0.0
+
+    def start(self) -> None:
+        """Start the clocks."""
+        self._start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+
+    def stop(self) -> None:
+        """Stop the clocks."""
+        self.wall_time = time.perf_counter() - self._start
+        self.cpu_time += time.thread_time() - self._cpu_start
+
+    def merge(self, other: "StageStats") -> None:
+        """Add the CPU time, rows and statements of a part of the stage, e.g. a worker.
+
+        Args:
+            other: Measurements of the part.
+        """
+        self.cpu_time += other.cpu_time
+        self.rows_in += other.rows_in
+        self.rows_out += other.rows_out
+        self.statements += other.statements
+
+    def to_dict(self) -> dict:
+        """Measurements as a dictionary.
+
+        Returns:
+            Public fields and rows per second.
+        """
+        stats = {key: val for key, val in asdict(self).items() if key[0] != "_"}
+        stats["rows_per_sec"] = self.rows_per_sec
+        return stats
+
+
+@dataclass
+class RunReport:
+    """Measurements of all stages of a run."""
+
+    started_at: str = field(
+        default_factory=lambda: datetime.now(timezone.utc).isoformat()
+    )
+    wall_time: float = 0.0
+    stages: List[StageStats] = field(default_factory=list)
+    critical_path: List[str] = field(default_factory=list)
+    critical_path_time: float = 0.0
+
+    def to_dict(self) -> dict:
+        """Report as a dictionary.
+
+        Returns:
+            Run-level fields and measurements of each stage.
+        """
+        return {
+            "started_at": self.started_at,
+            "wall_time": self.wall_time,
+            "critical_path": self.critical_path,
+            "critical_path_time": self.critical_path_time,
+            "stages": [stats.to_dict() for stats in self.stages],
+        }
+
+    def to_json(self) -> str:
+        """Report as JSON.
+
+        Returns:
+            Indented JSON document.
+        """
+        return json.dumps(self.to_dict(), indent=2)
+
+    def write(self, path: Path) -> None:
+        """Write the report as JSON.
+
+        Args:
+            path: File to write.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(self.to_json() + "\n")
@@ -0,0 +1,86 @@
+"""Scheduling of pipeline stages with dependencies."""
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Tuple
+
+# Mapping of each node to the nodes it depends on
+Graph = Dict[str, Tuple[str, ...]]
+
+
+def run_graph(graph: Graph, func: Callable[[str], None], max_workers: int) -> None:
+    """Run each node of a dependency graph once all of its dependencies completed.
+
+    Independent nodes run concurrently in a pool of threads. After a failure no
+    further nodes are started; running nodes are awaited and the first error is raised.
+
+    Args:
+        graph: Dependencies of each node.
+        func: Function run with the name of each node.
+        max_workers: Maximum number of nodes run at the same time.
+
+    Raises:
+        ValueError: If dependencies are missing or cyclic.
+    """
+    remaining = dict(graph)
+    running: Dict[Future, str] = {}
+    done = set()
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while remaining or running:
+            if error is None:
+                ready = [
+                    name
+                    for name, deps in remaining.items()
+                    if all(dep in done for dep in deps)
+                ]
+                for name in ready:
+                    del remaining[name]
+                    running[executor.submit(func, name)] = name
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                name = running.pop(future)
+                if future.exception() is None:
+                    done.add(name)
+                elif error is None:
+                    error = future.exception()
+
+    if error is not None:
+        raise error
+    if remaining:
+        raise ValueError(f"Unresolvable dependencies: {sorted(remaining)}")
+
+
+def critical_path(graph: Graph, durations: Dict[str, float]) -> Tuple[List[str], float]:
+    """Longest chain of dependent nodes, which bounds the runtime of the graph.
+
+    Args:
+        graph: Dependencies of each node.
+        durations: Duration of each node.
+
+    Returns:
+        Nodes of the chain in order and its total duration.
+    """
+    finish: Dict[str, float] = {}
+    previous: Dict[str, str | None] = {}
+
+    def visit(name: str) -> float:
+        if name not in finish:
+            dep = max(graph[name], key=visit, default=None)
+            finish[name] = durations.get(name, 0.0) + (finish[dep] if dep else 0.0)
+            previous[name] = dep
+        return finish[name]
+
+    last = max(graph, key=visit, default=None)
+    path = []
+
+    node = last
+    while node is not None:
+        path.append(node)
+        node = previous[node]
+
+    return path[::-1], finish[last] if last else 0.0
@@ -0,0 +1,73 @@
+"""Session settings of the connections of a pipeline run."""
+from typing import Any, Dict
+
+from sqlalchemy import text
+from sqlalchemy.future import Connection
+
+# Settings applied to every connection of a run, per profile
+PROFILES: Dict[str, Dict[str, str]] = {
+    "default": {},
+    "bulk": {
+        # Commits do not wait for the WAL flush, a crash loses the last transactions
+        # but never corrupts the database
+        "synchronous_commit": "off",
+        # Hash joins and aggregations of the SQL stages
+        "work_mem": "256MB",
+        # Index builds and constraint validation
+        "maintenance_work_mem": "1GB",
+        "max_parallel_maintenance_workers": "4",
+    },
+}
+
+
+def apply_settings(dbapi_conn: Any, settings: Dict[str, str]) -> None:
+    """Set session settings on a DBAPI connection.
+
+    Args:
+        dbapi_conn: psycopg2 connection.
+        settings: Values by setting name.
+    """
+    if not settings:
+        return
+
+    with dbapi_conn.cursor() as cursor:
+        for name, value in settings.items():
+            cursor.execute("SELECT set_config(%s, %s, false)", (name, value))
+
+    # Settings made in a transaction are undone by its rollback
+    dbapi_conn.commit()
+
+
+def reset_settings(dbapi_conn: Any) -> None:
+    """Reset all session settings of a DBAPI connection to their defaults.
+
+    Args:
+        dbapi_conn: psycopg2 connection.
+    """
+    with dbapi_conn.cursor() as cursor:
+        cursor.execute("RESET ALL")
+
+    dbapi_conn.commit()
+
+
+def set_setting(conn: Connection, name: str, value: str) -> str:
+    """Change a session setting in the current transaction.
+
+    Args:
+        conn: Connection to change.
+        name: Name of the setting.
+        value: New value.
+
+    Returns:
+        Previous value.
+    """
+    previous = conn.execute(
+        text("SELECT current_setting(:name)").bindparams(name=name)
+    ).scalar()
+    conn.execute(
+        text("SELECT set_config(:name, :value, false)").bindparams(
+            name=name, value=value
+        )
+    )
+
+    return previous
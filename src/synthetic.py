@@ -0,0 +1,175 @@
+"""Synthetic h5 files with the layout of the million songs dataset."""
+import argparse
+import logging
+import string
+from pathlib import Path
+from typing import Dict, List
+
+import h5py
+import numpy as np
+
+from read import ANALYSIS_ARRAYS, SONG_FIELDS
+
+# Types of the song fields, all other fields are floats
+STRING_FIELDS = {"track_id", "artist_name", "artist_location", "release", "title"}
+INTEGER_FIELDS = {"year"}
+
+# Cardinalities relative to the number of tracks, roughly those of the full dataset
+TRACKS_PER_ARTIST = 22
+ALBUMS_PER_ARTIST = 3
+ARTISTS_PER_LOCATION = 4
+MISSING_LOCATION_RATE = 0.4
+MISSING_COORDINATES_RATE = 0.5
+MISSING_YEAR_RATE = 0.5
+
+
+def song_dtypes() -> Dict[str, np.dtype]:
+    """Compound types of the song tables, with the fields read by `read_h5`.
+
+    Returns:
+        Compound type per song table.
+    """
+    dtypes = {}
+
+    for item, names in SONG_FIELDS.items():
+        fields = []
+        for name in names:
+            if name in STRING_FIELDS:
+                fields.append((name, "S256"))
+            elif name in INTEGER_FIELDS:
+                fields.append((name, "<i4"))
+            else:
+                fields.append((name, "<f8"))
+        if item == "analysis/songs":
+            fields += [(f"idx_{name}", "<i4") for name in ANALYSIS_ARRAYS]
+        dtypes[item] = np.dtype(fields)
+
+    return dtypes
+
+
+def track_ids(rng: np.random.Generator, n_files: int) -> List[str]:
+    """Random track ids like TRAAAAW128F429D538.
+
+    Args:
+        rng: Random generator.
+        n_files: Number of ids.
+
+    Returns:
+        Unique track ids.
+    """
+    alphabet = np.array(list(string.ascii_uppercase + string.digits))
+    ids = set()
+
+    while len(ids) < n_files:
+        chars = rng.choice(alphabet, size=(n_files - len(ids), 16))
+        ids.update("TR" + "".join(row) for row in chars)
+
+    return sorted(ids)
+
+
+def generate(
+    out_dir: Path, n_files: int, seed: int = 0, mean_segments: int = 50
+) -> None:
+    """Write synthetic h5 files, one per track, in out_dir/<A>/<B>/<C>/<track_id>.h5.
+
+    Artists, their locations and albums are drawn from pools sized like the full
+    dataset, so the transform stages see realistic duplicate counts.
+
+    Args:
+        out_dir: Directory to write to.
+        n_files: Number of files.
+        seed: Seed of the random generator.
+        mean_segments: Mean number of segments per track; beats, bars, tatums and
+            sections are scaled from it.
+    """
+    rng = np.random.default_rng(seed)
+    dtypes = song_dtypes()
+
+    n_artists = max(n_files // TRACKS_PER_ARTIST, 1)
+    n_locations = max(n_artists // ARTISTS_PER_LOCATION, 1)
+
+    # Location pool with coordinates
+    location_coords = np.column_stack(
+        [rng.uniform(-60, 70, n_locations), rng.uniform(-180, 180, n_locations)]
+    )
+
+    # Artist pool: location, coordinates (possibly missing or slightly off)
+    artist_location = rng.integers(0, n_locations, n_artists)
+    artist_location[rng.random(n_artists) < MISSING_LOCATION_RATE] = -1
+    artist_coords = location_coords[artist_location] + rng.normal(
+        0, 0.01, (n_artists, 2)
+    ) * (rng.random((n_artists, 1)) < 0.05)
+    artist_coords[rng.random(n_artists) < MISSING_COORDINATES_RATE] = np.nan
+    artist_coords[artist_location == -1] = np.nan
+
+    # Tracks: skewed assignment to artists, albums per artist
+    artists = np.minimum(rng.zipf(1.5, n_files) - 1, n_artists - 1)
+    artists = rng.permutation(n_artists)[artists]
+    albums = rng.integers(0, ALBUMS_PER_ARTIST, n_files)
+    years = rng.integers(1950, 2011, n_files)
+    years[rng.random(n_files) < MISSING_YEAR_RATE] = 0
+    durations = rng.gamma(8, 30, n_files)
+
+    for i, track_id in enumerate(track_ids(rng, n_files)):
+        artist = artists[i]
+        location = artist_location[artist]
+
+        values = {
+            "track_id": track_id,
+            "artist_name": f"Artist {artist}",
+            "artist_location": f"City {location}" if location >= 0 else "",
+            "artist_latitude": artist_coords[artist, 0],
+            "artist_longitude": artist_coords[artist, 1],
+            "release": f"Album {artist}-{albums[i]}",
+            "title": f"Song {i}",
+            "year": years[i],
+            "danceability": 0.0,
+            "duration": durations[i],
+            "end_of_fade_in": rng.exponential(0.5),
+            "start_of_fade_out": durations[i] - rng.exponential(10),
+            "loudness": rng.normal(-10, 5),
+            "tempo": rng.normal(120, 30),
+        }
+
+        n_segments = rng.poisson(mean_segments)
+        arrays = {
+            "segments_timbre": rng.normal(0, 50, (n_segments, 12)),
+            "segments_pitches": rng.random((n_segments, 12)),
+            "segments_loudness_max": rng.normal(-10, 5, n_segments),
+            "beats_start": np.sort(rng.random(n_segments // 2)) * durations[i],
+            "bars_start": np.sort(rng.random(n_segments // 8)) * durations[i],
+            "tatums_start": np.sort(rng.random(n_segments)) * durations[i],
+            "sections_start": np.sort(rng.random(n_segments // 50)) * durations[i],
+        }
+
+        file_path = out_dir.joinpath(*track_id[2:5], f"{track_id}.h5")
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with h5py.File(file_path, "w") as hf:
+            for item, dtype in dtypes.items():
+                row = np.zeros(1, dtype=dtype)
+                for name in dtype.names:
+                    if name in values:
+                        row[name] = values[name]
+                hf.create_dataset(item, data=row)
+            for name, arr in arrays.items():
+                hf.create_dataset(f"analysis/{name}", data=arr)
+
+        if (i + 1) % 10000 == 0:
+            logging.info("%d files written.", i + 1)
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out_dir", type=Path, help="Directory to write files to.")
+    parser.add_argument("n_files", type=int, help="Number of files.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument(
+        "--mean-segments", type=int, default=50, help="Mean segments per track."
+    )
+    args = parser.parse_args()
+
+    generate(args.out_dir, args.n_files, args.seed, args.mean_segments)
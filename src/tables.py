@@ -1,8 +1,28 @@
 """Metadata / database schema."""
 
-from sqlalchemy import Column, ForeignKey, Integer, MetaData, Numeric, String, Table
+from sqlalchemy import (
+    ARRAY,
+    BigInteger,
+    Boolean,
+    Column,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    Numeric,
+    String,
+    Table,
+)
 
-metadata = MetaData()
+# Constraint names as chosen by Postgres, so they can be dropped and recreated by name
+metadata = MetaData(
+    naming_convention={
+        "pk": "%(table_name)s_pkey",
+        "uq": "%(table_name)s_%(column_0_N_name)s_key",
+        "fk": "%(table_name)s_%(column_0_name)s_fkey",
+    }
+)
 
 artist_table_init = Table(
     "artists_init",
@@ -36,6 +56,13 @@ artist_location_table = Table(
     Column("id", Integer, primary_key=True),
     Column("artist_id", Integer, ForeignKey("artists.id")),
     Column("location_id", Integer, ForeignKey("locations.id")),
+    # Conflict target of the mapping upsert
+    Index(
+        "ix_artists_locations_artist_id_location_id",
+        "artist_id",
+        "location_id",
+        unique=True,
+    ),
 )
 
 song_table_init = Table(
@@ -52,20 +79,46 @@ song_table_init = Table(
     Column("bpm", Numeric),
     Column("album_name", String),
     Column("artist_name", String),
+    Column("track_id", String),
+)
+
+file_table_init = Table(
+    "files_init",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("path", String),
+    Column("size", BigInteger),
+    Column("mtime", Float),
+    Column("track_id", String),
 )
 
+# Indexes of the intermediary tables as name: (table, columns). They are not part of
+# the metadata since they are only built after the initial load.
+init_indexes = {
+    "ix_artists_init_name": ("artists_init", ("name",)),
+    "ix_artists_init_location": ("artists_init", ("location",)),
+    "ix_songs_init_artist_name_album_name": (
+        "songs_init",
+        ("artist_name", "album_name"),
+    ),
+}
+
 album_table = Table(
     "albums",
     metadata,
     Column("id", Integer, primary_key=True),
     Column("title", String, nullable=False),
     Column("artist_id", Integer, ForeignKey("artists.id")),
+    # Lookup of albums by title and artist in the songs pipeline, conflict target of
+    # the album upsert
+    Index("ix_albums_title_artist_id", "title", "artist_id", unique=True),
 )
 
 song_table = Table(
     "songs",
     metadata,
     Column("id", Integer, primary_key=True),
+    Column("track_id", String, unique=True),
     Column("title", String),
     Column("year", Integer),
     Column("danceability", Numeric),
@@ -77,3 +130,36 @@ song_table = Table(
     Column("album_id", Integer, ForeignKey("albums.id")),
     Column("artist_id", Integer, ForeignKey("artists.id")),
 )
+
+# Manifest of ingested files
+file_table = Table(
+    "files",
+    metadata,
+    Column("path", String, primary_key=True),
+    Column("size", BigInteger, nullable=False),
+    Column("mtime", Float, nullable=False),
+    Column("track_id", String),
+)
+
+# Per-track analysis arrays, segments_timbre and segments_pitches are (segments x 12)
+analysis_table = Table(
+    "track_analysis",
+    metadata,
+    Column("track_id", String, primary_key=True),
+    Column("segments_timbre", ARRAY(Float, dimensions=2)),
+    Column("segments_pitches", ARRAY(Float, dimensions=2)),
+    Column("segments_loudness_max", ARRAY(Float)),
+    Column("beats_start", ARRAY(Float)),
+    Column("bars_start", ARRAY(Float)),
+    Column("tatums_start", ARRAY(Float)),
+    Column("sections_start", ARRAY(Float)),
+)
+
+# Progress of a run, to resume it after an interruption
+checkpoint_table = Table(
+    "checkpoints",
+    metadata,
+    Column("stage", String, primary_key=True),
+    Column("batches", Integer, nullable=False, server_default="0"),
+    Column("completed", Boolean, nullable=False, server_default="false"),
+)
@@ -1,34 +1,37 @@
 """Helper functions."""
-from typing import Any
+import math
+import queue
+import threading
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List
 
 import numpy as np
-import pandas as pd
 
 
-def get_scalar(ser: pd.Series) -> Any:
-    """Get the scalar value from a pandas Series of length 1.
+def get_scalar(val: Any) -> Any:
+    """Normalize a scalar value read from a file.
 
     Args:
-        ser: A pandas series.
+        val: A Python or numpy scalar.
 
     Returns:
-        Scalar value.
+        Scalar value, None if it is missing.
     """
-    val = ser.to_numpy()[0]
-    val = None if pd.isnull(val) else val
+    if val is None or (isinstance(val, (float, np.floating)) and math.isnan(val)):
+        return None
     return val
 
 
-def encode_str(ser: pd.Series) -> str | None:
+def encode_str(val: Any) -> str | None:
     """Encode byte strings.
 
     Args:
-        ser: A pandas series.
+        val: A scalar value.
 
     Returns:
         String value.
     """
-    val = get_scalar(ser)
+    val = get_scalar(val)
 
     if val is None:
         return val
@@ -42,16 +45,16 @@ def encode_str(ser: pd.Series) -> str | None:
     return val
 
 
-def cast_numeric(ser: pd.Series) -> int | float | None:
+def cast_numeric(val: Any) -> int | float | None:
     """Cast numpy numerics.
 
     Args:
-        ser: A pandas series.
+        val: A scalar value.
 
     Returns:
         Numeric value.
     """
-    val = get_scalar(ser)
+    val = get_scalar(val)
 
     if val is None:
         return val
@@ -62,3 +65,164 @@ def cast_numeric(ser: pd.Series) -> int | float | None:
         val = float(val)
 
     return val
+
+
+def encode_str_array(arr: np.ndarray) -> list:
+    """Vectorized `encode_str` for a column of (byte) strings.
+
+    Args:
+        arr: Array of byte strings or strings.
+
+    Returns:
+        String values, None for empty strings.
+    """
+    arr = np.asarray(arr)
+
+    if arr.dtype.kind == "S":
+        arr = np.char.decode(arr, "utf8")
+
+    vals = arr.astype(object)
+    vals[arr == ""] = None
+
+    return vals.tolist()
+
+
+def cast_numeric_array(arr: np.ndarray) -> list:
+    """Vectorized `cast_numeric` for a column of numerics.
+
+    Args:
+        arr: Numeric array.
+
+    Returns:
+        Python numerics, None for NaN.
+    """
+    arr = np.asarray(arr)
+
+    vals = arr.astype(object)
+    if arr.dtype.kind == "f":
+        vals[np.isnan(arr)] = None
+
+    return vals.tolist()
+
+
+def concat_columns(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """Concatenate the rows of column sets with the same columns.
+
+    Args:
+        parts: Mappings of column name to array.
+
+    Returns:
+        Mapping of column name to the arrays of all parts, in order.
+    """
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of at most `size` items.
+
+    Args:
+        iterable: Items to split.
+        size: Maximum number of items per chunk.
+
+    Yields:
+        Chunks of items.
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def prefetch(iterable: Iterable, maxsize: int) -> Iterator:
+    """Iterate in a background thread, buffering at most `maxsize` items.
+
+    Exceptions of the background thread are raised in the consumer. If the consumer
+    stops early, it must close the generator (e.g. with `contextlib.closing`): the
+    background thread then stops after its current item and closes the iterable.
+
+    Args:
+        iterable: Items to produce.
+        maxsize: Maximum number of buffered items.
+
+    Yields:
+        Items of the iterable.
+    """
+    buffer = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except Exception as err:
+            put((end, err))
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, err = buffer.get()
+            if err is not None:
+                raise err
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class SharedIterator:
+    """Iterator that several threads can consume concurrently.
+
+    Each item is handed to exactly one thread. After `close`, consumers stop and the
+    underlying iterator is closed.
+    """
+
+    def __init__(self, iterable: Iterable) -> None:
+        """Initialize iterator.
+
+        Args:
+            iterable: Items to share.
+        """
+        self._iterator = iter(iterable)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __iter__(self) -> "SharedIterator":
+        """Iterator itself."""
+        return self
+
+    def __next__(self) -> Any:
+        """Next item of the underlying iterator.
+
+        Returns:
+            Item not handed to any other thread.
+        """
+        with self._lock:
+            if self._closed:
+                raise StopIteration
+            return next(self._iterator)
+
+    def close(self) -> None:
+        """Stop the iteration for all consumers."""
+        with self._lock:
+            self._closed = True
+            if hasattr(self._iterator, "close"):
+                self._iterator.close()
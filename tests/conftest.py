@@ -0,0 +1,50 @@
+"""Shared fixtures of the tests."""
+import os
+import sys
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.future import Connection
+
+# Modules of the pipeline are imported from src, like in the container
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from synthetic import generate  # noqa: E402
+
+
+@pytest.fixture
+def conn() -> Iterator[Connection]:
+    """Connection to the database of TEST_DATABASE_URL, rolled back after the test.
+
+    Yields:
+        Connection in an open transaction.
+    """
+    url = os.environ.get("TEST_DATABASE_URL")
+    if url is None:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    engine = create_engine(url, future=True)
+
+    with engine.connect() as connection:
+        connection.begin()
+        yield connection
+        connection.rollback()
+
+    engine.dispose()
+
+
+@pytest.fixture
+def data_dir(tmp_path: Path) -> Path:
+    """Directory of synthetic h5 files.
+
+    Args:
+        tmp_path: Temporary directory of the test.
+
+    Returns:
+        Directory with 20 files in nested directories.
+    """
+    out_dir = tmp_path / "data"
+    generate(out_dir, 20, mean_segments=10)
+    return out_dir
@@ -0,0 +1,96 @@
+"""Columnar cache of fields read from h5 files."""
+import os
+from pathlib import Path
+from typing import List
+
+import pytest
+
+import etl
+from cache import cache_key
+from read import get_file_paths
+from utils import chunked
+
+
+@pytest.fixture
+def reads(monkeypatch: pytest.MonkeyPatch) -> List[Path]:
+    """Record the files decoded by `extract_rows`.
+
+    Args:
+        monkeypatch: Patches of the test.
+
+    Returns:
+        Paths of the decoded files, in order.
+    """
+    paths = []
+    read_h5 = etl.read_h5
+
+    def record(file_path: Path) -> dict:
+        paths.append(file_path)
+        return read_h5(file_path)
+
+    monkeypatch.setattr(etl, "read_h5", record)
+    return paths
+
+
+def extract(file_paths: List[Path], cache_dir: Path, batch_size: int) -> List[dict]:
+    """Rows of the songs table for files read in chunks.
+
+    Args:
+        file_paths: Paths of h5 files.
+        cache_dir: Root directory of the cache.
+        batch_size: Number of files per chunk.
+
+    Returns:
+        Rows of all chunks.
+    """
+    rows = []
+    for chunk in chunked(file_paths, batch_size):
+        chunk_rows, failures = etl.extract_rows(chunk, cache_dir)
+        assert failures == []
+        rows.extend(chunk_rows["songs_init"])
+    return rows
+
+
+def test_cache_key() -> None:
+    """Partitions are keyed by directory and set of fields."""
+    assert cache_key("/data/A", ["title", "year"]) == cache_key(
+        "/data/A", ["year", "title"]
+    )
+    assert cache_key("/data/A", ["title"]) != cache_key("/data/B", ["title"])
+    assert cache_key("/data/A", ["title"]) != cache_key("/data/A", ["year"])
+
+
+def test_cache_independent_of_chunks(
+    data_dir: Path, tmp_path: Path, reads: List[Path]
+) -> None:
+    """Files cached in one chunking are served in another, without decoding."""
+    file_paths = sorted(get_file_paths(data_dir))
+    cache_dir = tmp_path / "cache"
+
+    expected = extract(file_paths, cache_dir, 7)
+    reads.clear()
+
+    assert extract(file_paths, cache_dir, 5) == expected
+    assert extract(file_paths[::-1], cache_dir, 20) == expected[::-1]
+    assert reads == []
+
+
+def test_cache_reads_changed_file(
+    data_dir: Path, tmp_path: Path, reads: List[Path]
+) -> None:
+    """Only files whose mtime changed are decoded again."""
+    file_paths = sorted(get_file_paths(data_dir))
+    cache_dir = tmp_path / "cache"
+
+    expected = extract(file_paths, cache_dir, 7)
+    reads.clear()
+
+    stat = file_paths[3].stat()
+    os.utime(file_paths[3], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert extract(file_paths, cache_dir, 7) == expected
+    assert reads == [file_paths[3]]
+
+    reads.clear()
+    extract(file_paths, cache_dir, 7)
+    assert reads == []
@@ -0,0 +1,108 @@
+"""Deduplication of dimensions in a direct load."""
+from typing import List, Tuple
+
+from direct import SONG_COLUMNS, DirectLoad
+
+
+def rows(
+    songs: List[Tuple[str | None, str | None, float | None, str | None, str | None]],
+) -> Tuple[List[dict], List[dict]]:
+    """Intermediary artist and song rows.
+
+    Args:
+        songs: Artist name, location, latitude, album and track id of each song.
+
+    Returns:
+        Rows for the artists_init and songs_init tables.
+    """
+    artist_rows, song_rows = [], []
+
+    for name, location, latitude, album, track_id in songs:
+        artist_rows.append(
+            {
+                "name": name,
+                "location": location,
+                "latitude": latitude,
+                "longitude": latitude,
+            }
+        )
+        song = dict.fromkeys(SONG_COLUMNS)
+        song.update(track_id=track_id, album_name=album, artist_name=name)
+        song_rows.append(song)
+
+    return artist_rows, song_rows
+
+
+def test_add_batch_dimensions() -> None:
+    """Artists and albums are created once, with ids after the existing ones."""
+    direct_load = DirectLoad()
+    direct_load.artists = {"Known": 7}
+    direct_load.next_ids.update(artists=8, albums=3)
+
+    new_rows = direct_load.add_batch(
+        *rows(
+            [
+                ("Known", None, None, "Album", "TR1"),
+                ("New", None, None, "Album", "TR2"),
+                ("New", None, None, "Album", "TR3"),
+                (None, None, None, "Album", "TR4"),
+            ]
+        )
+    )
+
+    assert new_rows["artists"] == [{"id": 8, "name": "New"}]
+    assert new_rows["albums"] == [
+        {"id": 3, "title": "Album", "artist_id": 7},
+        {"id": 4, "title": "Album", "artist_id": 8},
+        {"id": 5, "title": "Album", "artist_id": None},
+    ]
+    assert [(s["album_id"], s["artist_id"]) for s in new_rows["songs"]] == [
+        (3, 7),
+        (4, 8),
+        (4, 8),
+        (None, None),
+    ]
+
+
+def test_add_batch_skips_songs_without_track_id() -> None:
+    """Songs without a track id are skipped, their artists are kept."""
+    direct_load = DirectLoad()
+
+    new_rows = direct_load.add_batch(*rows([("Artist", None, None, None, None)]))
+
+    assert new_rows["songs"] == []
+    assert new_rows["artists"] == [{"id": 1, "name": "Artist"}]
+    assert direct_load.n_skipped == 1
+
+
+def test_finish_locations() -> None:
+    """Coordinates and mappings are only kept if unique and never missing."""
+    direct_load = DirectLoad()
+    direct_load.locations = {"Known": 4}
+    direct_load.next_ids["locations"] = 5
+
+    direct_load.add_batch(
+        *rows(
+            [
+                ("A", "Paris", 48.8, None, "TR1"),
+                ("A", "Paris", 48.8, None, "TR2"),
+                ("B", "Rome", 41.9, None, "TR3"),
+                ("B", "Rome", None, None, "TR4"),
+                ("C", "Paris", 48.8, None, "TR5"),
+                ("C", "Rome", 41.9, None, "TR6"),
+                ("D", "Known", None, None, "TR7"),
+                ("D", None, None, None, "TR8"),
+            ]
+        )
+    )
+    new_rows = direct_load.finish()
+
+    assert new_rows["locations"] == [
+        {"id": 5, "name": "Paris", "latitude": 48.8, "longitude": 48.8},
+        {"id": 6, "name": "Rome", "latitude": None, "longitude": None},
+    ]
+    artists = direct_load.artists
+    assert new_rows["artists_locations"] == [
+        {"artist_id": artists["A"], "location_id": 5},
+        {"artist_id": artists["B"], "location_id": 6},
+    ]
@@ -0,0 +1,104 @@
+"""Extraction of rows from h5 files."""
+import shutil
+from pathlib import Path
+
+import h5py
+import pytest
+
+from etl import extract_analysis, extract_rows, plan_counts
+from read import get_file_paths
+
+UPSERT_PLAN = """\
+Insert on songs  (cost=69.75..102.26 rows=299 width=107) \
+(actual time=0.787..5.382 rows=300 loops=1)
+  Conflict Resolution: UPDATE
+  Conflict Arbiter Indexes: songs_track_id_key
+  Tuples Inserted: 120
+  Conflicting Tuples: 180
+  Buffers: shared hit=4116 dirtied=8 written=8
+  ->  Hash Right Join  (cost=69.75..102.26 rows=299 width=107) \
+(actual time=0.665..0.989 rows=301 loops=1)
+        Hash Cond: (al.artist_id = a.id)
+Planning Time: 0.363 ms
+Execution Time: 5.461 ms
+"""
+
+INSERT_PLAN = """\
+Insert on artists  (cost=0.00..17.20 rows=720 width=80) \
+(actual time=0.098..1.352 rows=39.00 loops=1)
+  ->  HashAggregate  (cost=16.50..18.50 rows=200 width=32) \
+(actual time=0.071..0.080 rows=41.00 loops=1)
+        Group Key: artists_init.name
+Execution Time: 1.383 ms
+"""
+
+
+def set_field(file_path: Path, item: str, name: str, value: bytes) -> None:
+    """Overwrite a field of the first row of a compound dataset.
+
+    Args:
+        file_path: Path of an h5 file.
+        item: Name of the compound dataset.
+        name: Name of the field.
+        value: New value.
+    """
+    with h5py.File(file_path, "r+") as hf:
+        rows = hf[item][:]
+        rows[name] = value
+        hf[item][...] = rows
+
+
+def test_analysis_keeps_last_track(data_dir: Path) -> None:
+    """Tracks read twice in a chunk are loaded once, from the last file."""
+    file_paths = sorted(get_file_paths(data_dir))
+    copy_path = data_dir / "copy.h5"
+    shutil.copy(file_paths[0], copy_path)
+
+    rows, failures = extract_analysis(file_paths + [copy_path])
+
+    track_ids = [row["track_id"] for row in rows]
+    assert failures == []
+    assert len(track_ids) == len(set(track_ids)) == len(file_paths)
+
+
+def test_analysis_fails_file_without_track_id(data_dir: Path) -> None:
+    """Files without a track id are failures, the other files are loaded."""
+    file_paths = sorted(get_file_paths(data_dir))
+    set_field(file_paths[3], "analysis/songs", "track_id", b"")
+
+    rows, failures = extract_analysis(file_paths)
+
+    assert [file_path for file_path, _ in failures] == [file_paths[3]]
+    assert len(rows) == len(file_paths) - 1
+    assert all(row["track_id"] for row in rows)
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_rows_drop_undecodable_file(
+    data_dir: Path, tmp_path: Path, cached: bool
+) -> None:
+    """A file that is not valid UTF-8 fails alone, the rest of its chunk is loaded."""
+    file_paths = sorted(get_file_paths(data_dir))
+    set_field(file_paths[5], "metadata/songs", "title", b"Caf\xe9")
+    cache_dir = tmp_path / "cache" if cached else None
+
+    if cached:
+        extract_rows(file_paths, cache_dir)
+
+    rows, failures = extract_rows(file_paths, cache_dir)
+
+    assert [file_path for file_path, _ in failures] == [file_paths[5]]
+    assert [row["path"] for row in rows["files_init"]] == [
+        str(file_path) for file_path in file_paths if file_path != file_paths[5]
+    ]
+    assert len(rows["songs_init"]) == len(rows["artists_init"]) == len(file_paths) - 1
+
+
+def test_plan_counts_upsert() -> None:
+    """Rows of the top node are written, of which the inserted tuples are new."""
+    assert plan_counts(UPSERT_PLAN) == (300, 120)
+
+
+def test_plan_counts_insert() -> None:
+    """Without a conflict clause, all written rows are inserted."""
+    assert plan_counts(INSERT_PLAN) == (39, 39)
@@ -0,0 +1,127 @@
+"""Round trips of the COPY encoders through the database."""
+from decimal import Decimal
+from typing import List
+
+import numpy as np
+import pytest
+from sqlalchemy import (
+    ARRAY,
+    BigInteger,
+    Column,
+    Float,
+    Integer,
+    MetaData,
+    Numeric,
+    Table,
+    text,
+)
+from sqlalchemy.engine import Row
+from sqlalchemy.future import Connection
+
+from loader import COPY_FORMATS, copy_rows
+
+roundtrip_table = Table(
+    "copy_roundtrip",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("num", Numeric),
+    Column("big", BigInteger),
+    Column("small", Integer),
+    Column("dbl", Float),
+    prefixes=["TEMPORARY"],
+)
+
+array_table = Table(
+    "copy_roundtrip_arrays",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("matrix", ARRAY(Float, dimensions=2)),
+    Column("vector", ARRAY(Float)),
+    prefixes=["TEMPORARY"],
+)
+
+# Numbers and their text representation as PostgreSQL numeric
+NUMERICS = [
+    (0, "0"),
+    (-7, "-7"),
+    (-1.5, "-1.5"),
+    (0.1, "0.1"),
+    (1e-10, "0.0000000001"),
+    (1e20, "100000000000000000000"),
+    (10**30, "1000000000000000000000000000000"),
+    (-(10**25), "-10000000000000000000000000"),
+    (Decimal("123.4500"), "123.4500"),
+    (Decimal("-0.000012"), "-0.000012"),
+    (float("nan"), "NaN"),
+]
+
+
+def load(conn: Connection, table: Table, rows: List[dict], fmt: str) -> List[Row]:
+    """Load rows with COPY and read them back as text.
+
+    Args:
+        conn: Connection in a transaction.
+        table: Temporary table to load.
+        rows: Rows keyed by column name.
+        fmt: COPY format.
+
+    Returns:
+        Columns of the rows cast to text, in load order.
+    """
+    conn.execute(text(f"TRUNCATE {table.name}"))
+    with conn.connection.cursor() as cursor:
+        copy_rows(cursor, table, rows, fmt)
+
+    cols = ", ".join(f"CAST({col} AS text)" for col in rows[0])
+    return conn.execute(text(f"SELECT {cols} FROM {table.name} ORDER BY id")).all()
+
+
+@pytest.mark.parametrize("fmt", COPY_FORMATS)
+def test_numeric_roundtrip(conn: Connection, fmt: str) -> None:
+    """Numbers keep their value and scale in both COPY formats."""
+    roundtrip_table.create(conn)
+    rows = [
+        {"num": val, "big": None, "small": None, "dbl": None} for val, _ in NUMERICS
+    ]
+
+    res = load(conn, roundtrip_table, rows, fmt)
+
+    assert [num for num, *_ in res] == [expected for _, expected in NUMERICS]
+
+
+def test_scalars_binary_matches_text(conn: Connection) -> None:
+    """Binary COPY of scalar columns stores the same values as text COPY."""
+    roundtrip_table.create(conn)
+    rows = [
+        {"num": 1e20, "big": 2**62, "small": -5, "dbl": 1e-10},
+        {"num": -(10**30), "big": -(2**40), "small": 0, "dbl": 1e20},
+        {"num": 0, "big": 0, "small": 2**31 - 1, "dbl": -0.5},
+        {"num": None, "big": None, "small": None, "dbl": None},
+    ]
+
+    assert load(conn, roundtrip_table, rows, "binary") == load(
+        conn, roundtrip_table, rows, "text"
+    )
+
+
+def test_float_array_roundtrip(conn: Connection) -> None:
+    """Float arrays of any shape keep their elements in binary COPY."""
+    array_table.create(conn)
+    matrices = [
+        np.array([[0.0, -1.5], [1e-10, 1e20]]),
+        np.arange(24, dtype=np.float32).reshape(2, 12) / 7,
+        np.zeros((0, 12)),
+    ]
+    vectors = [np.array([1.0, -2.5, 1e-300]), np.array([]), None]
+    rows = [{"matrix": m, "vector": v} for m, v in zip(matrices, vectors)]
+
+    with conn.connection.cursor() as cursor:
+        copy_rows(cursor, array_table, rows, "binary")
+
+    res = conn.execute(
+        text("SELECT matrix, vector FROM copy_roundtrip_arrays ORDER BY id")
+    ).all()
+
+    assert res[0] == (matrices[0].tolist(), vectors[0].tolist())
+    assert res[1] == (matrices[1].astype(np.float64).tolist(), [])
+    assert res[2] == ([], None)
@@ -0,0 +1,88 @@
+"""Scheduling of stages with dependencies."""
+import threading
+from typing import List
+
+import pytest
+
+from scheduler import Graph, critical_path, run_graph
+
+GRAPH: Graph = {
+    "extract": (),
+    "analysis": (),
+    "artists": ("extract",),
+    "locations": ("extract",),
+    "mapping": ("artists", "locations"),
+    "files": ("mapping", "analysis"),
+}
+
+
+def test_run_graph_order() -> None:
+    """Each node runs once, after all of its dependencies."""
+    order: List[str] = []
+    lock = threading.Lock()
+
+    def func(name: str) -> None:
+        with lock:
+            order.append(name)
+
+    run_graph(GRAPH, func, max_workers=3)
+
+    assert sorted(order) == sorted(GRAPH)
+    for name, deps in GRAPH.items():
+        assert all(order.index(dep) < order.index(name) for dep in deps)
+
+
+def test_run_graph_concurrent() -> None:
+    """Independent nodes run at the same time."""
+    barrier = threading.Barrier(2, timeout=5)
+
+    def func(name: str) -> None:
+        if name in ("artists", "locations"):
+            barrier.wait()
+
+    run_graph(GRAPH, func, max_workers=2)
+
+
+def test_run_graph_failure() -> None:
+    """After a failure, dependent nodes do not start and the error is raised."""
+    started: List[str] = []
+
+    def func(name: str) -> None:
+        started.append(name)
+        if name == "artists":
+            raise RuntimeError("artists failed")
+
+    with pytest.raises(RuntimeError, match="artists failed"):
+        run_graph(GRAPH, func, max_workers=1)
+
+    assert "mapping" not in started and "files" not in started
+
+
+def test_run_graph_cycle() -> None:
+    """Cyclic dependencies are rejected instead of waiting forever."""
+    graph = {"a": ("b",), "b": ("a",), "c": ()}
+
+    with pytest.raises(ValueError, match="Unresolvable"):
+        run_graph(graph, lambda name: None, max_workers=2)
+
+
+def test_critical_path() -> None:
+    """The longest chain of dependent nodes bounds the runtime."""
+    durations = {
+        "extract": 5.0,
+        "analysis": 8.0,
+        "artists": 1.0,
+        "locations": 2.0,
+        "mapping": 1.0,
+        "files": 0.5,
+    }
+
+    path, total = critical_path(GRAPH, durations)
+
+    assert path == ["extract", "locations", "mapping", "files"]
+    assert total == pytest.approx(8.5)
+
+
+def test_critical_path_empty() -> None:
+    """An empty graph has an empty path."""
+    assert critical_path({}, {}) == ([], 0.0)
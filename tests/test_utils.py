@@ -0,0 +1,80 @@
+"""Vectorized encoders and iteration helpers."""
+import threading
+from contextlib import closing
+from typing import Iterator, List
+
+import numpy as np
+import pytest
+
+from utils import cast_numeric_array, concat_columns, encode_str_array, prefetch
+
+
+def test_encode_str_array() -> None:
+    """Byte strings are decoded, empty strings are missing."""
+    arr = np.array([b"Caf\xc3\xa9", b"", b"Song"])
+
+    assert encode_str_array(arr) == ["Café", None, "Song"]
+
+
+def test_encode_str_array_invalid() -> None:
+    """Invalid UTF-8 fails the whole column, see `etl.drop_undecodable`."""
+    with pytest.raises(UnicodeDecodeError):
+        encode_str_array(np.array([b"Song", b"Caf\xe9"]))
+
+
+def test_cast_numeric_array() -> None:
+    """Numpy numerics become Python numerics, NaN is missing."""
+    assert cast_numeric_array(np.array([1.5, np.nan])) == [1.5, None]
+    assert cast_numeric_array(np.array([2010, 0], dtype=np.int32)) == [2010, 0]
+
+
+def test_concat_columns() -> None:
+    """Rows of the parts are concatenated per column, in order."""
+    parts = [
+        {"path": np.array(["a", "b"]), "year": np.array([1, 2])},
+        {"path": np.array(["c"]), "year": np.array([3])},
+    ]
+
+    columns = concat_columns(parts)
+
+    assert columns["path"].tolist() == ["a", "b", "c"]
+    assert columns["year"].tolist() == [1, 2, 3]
+
+
+def test_prefetch_close_stops_thread() -> None:
+    """Closing the consumer stops the background thread and closes the iterable."""
+    events: List[str] = []
+
+    def produce() -> Iterator[int]:
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            events.append("closed")
+
+    n_threads = threading.active_count()
+
+    with pytest.raises(RuntimeError):
+        with closing(prefetch(produce(), maxsize=2)) as items:
+            for i in items:
+                if i == 3:
+                    raise RuntimeError("load failed")
+
+    assert events == ["closed"]
+    assert threading.active_count() == n_threads
+
+
+def test_prefetch_error() -> None:
+    """Errors of the background thread are raised in the consumer."""
+
+    def produce() -> Iterator[int]:
+        yield 1
+        raise ValueError("read failed")
+
+    items = prefetch(produce(), maxsize=2)
+
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="read failed"):
+        next(items)